@@ -8,10 +8,22 @@
 #!/usr/bin/python3
 
 import time
+import math
 import random
 import copy
+import heapq
+import multiprocessing
+import hashlib
+import collections
+import contextlib
+import shelve
+import statistics
 
 import requests as req
+try:
+    import numpy as np
+except ImportError:
+    np=None     # the "batch" engine of simulateANDanalyse is then not available
 from xml.etree import ElementTree as ET
 from xml.dom import minidom
 from enum import Enum
@@ -22,6 +34,12 @@ from examples import *
 
 counter=1
 
+# min number of simulations before checking the confidence interval in the adaptive mode of simulateANDanalyse
+MINRUNS=5
+
+# number of durations of a task drawn at once for each simulation (see DurationSamples)
+DURATIONBLOCK=4
+
 class NodeType(Enum):
     START = "startEvent"
     END = "endEvent"
@@ -31,16 +49,106 @@ class NodeType(Enum):
     PAR = "parallelGateway"
     INC = "inclusiveGateway"
 
+# kinds of nodes (the value is the name returned by getClass)
+# the kind attribute of a node is compared by identity (node.kind is NodeKind.ACTIVITY) in the
+#  simulations and analyses of the process, instead of comparing the strings of getClass
+class NodeKind(Enum):
+    START = "Start"
+    END = "End"
+    ACTIVITY = "Activity"
+    SPLIT = "Split"
+    JOIN = "Join"
+
+# resources are interned as integers: each one is given a number the first time it is seen
+#  (resources sets of tasks are then represented as bitmasks, bit i for resource number i)
+resourcesDIC={}
+
+# returns the bitmask of a set of resources
+def resourceMask(res):
+    mask=0
+    for r in res:
+        num=resourcesDIC.get(r)
+        if (num==None):
+            num=len(resourcesDIC)
+            resourcesDIC[r]=num
+        mask=mask|(1<<num)
+    return mask
+
+# returns the time units covered by an entry of a simulation log, from time start to time end
+#  (excluded), times of events being possibly non-integer with random durations (see Duration):
+#  time unit u stands for the interval ]u-1,u]
+def timeUnits(start, end):
+    return range(math.ceil(start), math.ceil(end))
+
+# returns the probabilities of the outgoing flows of an exclusive split (list, in the order of flows):
+#  flows without probability share what is left by the other ones (all the flows have the same
+#  probability if none is given), and probabilities are normalised so that their sum is 1
+def branchProbabilities(flows):
+    probs=[f.getProb() for f in flows]
+    nbnone=probs.count(None)
+    if (nbnone==len(probs)):
+        return [1/len(probs)]*len(probs)
+    if (nbnone>0):
+        rest=max(0, 1-sum(p for p in probs if (p!=None)))
+        probs=[rest/nbnone if (p==None) else p for p in probs]
+    total=sum(probs)
+    if (total<=0):
+        return [1/len(probs)]*len(probs)
+    return [p/total for p in probs]
+
+# computes the alias table (Vose's method) of a list of probabilities, used to choose an index
+#  in constant time (see sampleBranch): a couple (list of thresholds, list of aliases),
+#  or None if all the probabilities are the same
+def buildAliasTable(probs):
+    n=len(probs)
+    if (max(probs)-min(probs)<1e-12):
+        return None
+    threshold=[p*n for p in probs]
+    alias=list(range(n))
+    small=[i for i in range(n) if threshold[i]<1]
+    large=[i for i in range(n) if threshold[i]>=1]
+    while (small!=[]) and (large!=[]):
+        i=small.pop()
+        j=large.pop()
+        alias[i]=j
+        threshold[j]=threshold[j]+threshold[i]-1
+        if (threshold[j]<1):
+            small.append(j)
+        else:
+            large.append(j)
+    for i in small+large:
+        threshold[i]=1
+    return (threshold, alias)
+
+# chooses an index among n with an alias table (see buildAliasTable) and a random generator
+#  (random module or random.Random), uniformly if table is None
+def sampleBranch(table, n, rng):
+    if (table==None):
+        return rng.randint(0, n-1)
+    i=rng.randrange(n)
+    if (rng.random()<table[0][i]):
+        return i
+    return table[1][i]
+
 ##
 # A Node is an identifier
+# (nodes and flows use __slots__ to keep them small, and they are pickled/copied through
+#  their constructor, so that resource masks are computed again in the process where they are loaded)
 class Node:
+    __slots__=("id", "name")
 
     def __init__(self, ident):
         self.id=ident
 
+    def __reduce__(self):
+        return (self.__class__, (self.id,))
+
     def getIdent(self):
         return self.id
 
+    def getClass(self):
+        return self.kind.value
+
     def print(self):
         print(self.id)
 
@@ -51,14 +159,13 @@ class Node:
 ##
 # A start node
 class Start(Node):
+    __slots__=()
+    kind=NodeKind.START
 
     def __init__(self, ident):
         self.id=ident
         self.name=ident
 
-    def getClass(self):
-        return "Start"
-
     def print(self):
         print("start", self.id)
 
@@ -68,14 +175,13 @@ class Start(Node):
 ##
 # An end node
 class End(Node):
+    __slots__=()
+    kind=NodeKind.END
 
     def __init__(self, ident):
         self.id=ident
         self.name=ident
 
-    def getClass(self):
-        return "End"
-
     def print(self):
         print("end", self.id)
 
@@ -84,27 +190,152 @@ class End(Node):
 
 
 
+##
+# A distribution of durations of a task (see Activity): durations are drawn one at a time with
+# a random.Random generator (sample), or by arrays with a NumPy generator (sampleArray).
+# Distributions are compared by their parameters (processes with the same distributions are
+# identified by the simulation cache).
+class Duration:
+
+    def getParams(self):
+        return ()
+
+    def __eq__(self, other):
+        return (self.__class__==other.__class__) and (self.getParams()==other.getParams())
+
+    def __hash__(self):
+        return hash((self.__class__.__name__, self.getParams()))
+
+    def __repr__(self):
+        return self.__class__.__name__+repr(self.getParams())
+
+##
+# A duration uniformly distributed between low and high
+class UniformDuration(Duration):
+
+    def __init__(self, low, high):
+        self.low=low
+        self.high=high
+
+    def getParams(self):
+        return (self.low, self.high)
+
+    def getMean(self):
+        return (self.low+self.high)/2
+
+    def sample(self, rng):
+        return rng.uniform(self.low, self.high)
+
+    def sampleArray(self, rng, shape):
+        return rng.uniform(self.low, self.high, shape)
+
+##
+# A duration with a triangular distribution (between low and high, mode being the most likely value)
+class TriangularDuration(Duration):
+
+    def __init__(self, low, mode, high):
+        self.low=low
+        self.mode=mode
+        self.high=high
+
+    def getParams(self):
+        return (self.low, self.mode, self.high)
+
+    def getMean(self):
+        return (self.low+self.mode+self.high)/3
+
+    def sample(self, rng):
+        return rng.triangular(self.low, self.high, self.mode)
+
+    def sampleArray(self, rng, shape):
+        return rng.triangular(self.low, self.mode, self.high, shape)
+
+##
+# A duration exponentially distributed (with the given mean)
+class ExponentialDuration(Duration):
+
+    def __init__(self, mean):
+        self.mean=mean
+
+    def getParams(self):
+        return (self.mean,)
+
+    def getMean(self):
+        return self.mean
+
+    def sample(self, rng):
+        return rng.expovariate(1/self.mean)
+
+    def sampleArray(self, rng, shape):
+        return rng.exponential(self.mean, shape)
+
+##
+# A duration with a lognormal distribution (mu and sigma are the mean and standard deviation
+#  of the logarithm of the duration)
+class LognormalDuration(Duration):
+
+    def __init__(self, mu, sigma):
+        self.mu=mu
+        self.sigma=sigma
+
+    def getParams(self):
+        return (self.mu, self.sigma)
+
+    def getMean(self):
+        return math.exp(self.mu+self.sigma*self.sigma/2)
+
+    def sample(self, rng):
+        return rng.lognormvariate(self.mu, self.sigma)
+
+    def sampleArray(self, rng, shape):
+        return rng.lognormal(self.mu, self.sigma, shape)
+
+##
+# A duration drawn (uniformly) among observed values
+class EmpiricalDuration(Duration):
+
+    def __init__(self, values):
+        self.values=tuple(values)
+
+    def getParams(self):
+        return self.values
+
+    def getMean(self):
+        return sum(self.values)/len(self.values)
+
+    def sample(self, rng):
+        return rng.choice(self.values)
+
+    def sampleArray(self, rng, shape):
+        return rng.choice(np.array(self.values), shape)
+
 ##
 # An activity
+# the time of an activity is either a number (fixed duration) or a distribution (Duration),
+#  getTime returns the mean duration and getDuration the time as given
 class Activity(Node):
+    __slots__=("time", "duration", "res", "mask")
+    kind=NodeKind.ACTIVITY
 
     def __init__(self, ident, name, time, res):
-        self.ident=ident
+        self.id=ident
         self.name=name
-        self.time=time
+        self.duration=time
+        if isinstance(time, Duration):
+            self.time=time.getMean()
+        else:
+            self.time=time
         self.res=res
+        self.mask=resourceMask(res)
 
-    def getIdent(self):
-        return self.ident
+    def __reduce__(self):
+        return (Activity, (self.id, self.name, self.duration, self.res))
 
     def getName(self):
         return self.name
 
     def print(self):
-        print("activity", self.ident, self.name, self.time, self.res)
-
-    def getClass(self):
-        return "Activity"
+        print("activity", self.id, self.name, self.duration, self.res)
 
     #def setTime(self, time):
     #    self.time=time
@@ -112,11 +343,22 @@ class Activity(Node):
     def getRes(self):
         return self.res
 
+    # returns the resources of the task as a bitmask
+    def getResMask(self):
+        return self.mask
+
     def getTime(self):
         return self.time
 
+    def getDuration(self):
+        return self.duration
+
+    # checks whether the duration of the task is random
+    def isStochastic(self):
+        return isinstance(self.duration, Duration)
+
     def setIdent(self, ident):
-        self.ident=ident
+        self.id=ident
 
     def setName(self, name):
         self.name=name
@@ -127,52 +369,63 @@ class Activity(Node):
 ##
 # A split node
 class Split(Node):
+    __slots__=()
+    kind=NodeKind.SPLIT
 
     def __init__(self, ident, type):
         self.id=ident
         self.name=type  # this can be: exclusive, inclusive, parallel
 
+    def __reduce__(self):
+        return (Split, (self.id, self.name))
+
     def getType(self):
         return self.name
 
     def print(self):
         print("split", self.name, self.id)
 
-    def getClass(self):
-        return "Split"
-
     def isGateway(self):
         return True
 
 ##
 # A join node
 class Join(Node):
+    __slots__=()
+    kind=NodeKind.JOIN
 
     def __init__(self, ident, type):
         self.id=ident
         self.name=type  # this can be: exclusive, inclusive, parallel
 
+    def __reduce__(self):
+        return (Join, (self.id, self.name))
+
     def getType(self):
         return self.name
 
     def print(self):
         print("join", self.name, self.id)
 
-    def getClass(self):
-        return "Join"
-
     def isGateway(self):
         return True
 
 ##
 # A flow
+# the optional prob parameter is the probability of the flow when it goes out of an exclusive split
+#  (None if not given, see branchProbabilities)
 class Flow:
+    __slots__=("id", "source", "target", "prop", "prob")
 
-    def __init__(self, ident, source, target, prop="weak"):
+    def __init__(self, ident, source, target, prop="weak", prob=None):
         self.id=ident
         self.source=source  # source node
         self.target=target  # target node
         self.prop=prop
+        self.prob=prob
+
+    def __reduce__(self):
+        return (Flow, (self.id, self.source, self.target, self.prop, self.prob))
 
     def getIdent(self):
         return self.id
@@ -189,25 +442,121 @@ class Flow:
     def getProp(self):
         return self.prop
 
+    def getProb(self):
+        return self.prob
+
     def print(self):
         print("flow", self.id,":", self.source.getIdent(), "->", self.target.getIdent())
 
 ##
 # A BPMN graph is defined by a set of nodes and a set of flows.
+# The graph also keeps indexes (identifier -> node, identifier -> flow,
+#  node identifier -> outgoing/incoming flows, task name -> tasks), which are updated
+#  by addNode/addFlow/removeNode/removeFlow, so that lookups do not scan all nodes/flows.
 class BPMNGraph:
     def __init__(self, name, nodes, flows):
         self.name=name
         self.nodes = nodes
         self.flows = flows
+        self.nodesDIC = {}
+        self.namesDIC = {}
+        self.flowsDIC = {}
+        self.outDIC = {}
+        self.inDIC = {}
+        self.compiled = None    # compiled version of the process for simulation (see getCompiled)
+        self.branches = {}      # exclusive split ident -> (outgoing flows, alias table), see getBranchTable
+        self.structure = None   # matching of split and merge nodes (see getStructure)
+        self.reachability = None    # transitive closure of the flows (see getReachability)
+        for n in nodes:
+            self.indexNode(n)
+        for f in flows:
+            self.indexFlow(f)
+
+    # the indexes are derived from the nodes and flows, so they are rebuilt
+    # instead of being copied (copy.deepcopy) or pickled
+    def __getstate__(self):
+        return {"name": self.name, "nodes": self.nodes, "flows": self.flows}
+
+    def __setstate__(self, state):
+        self.__init__(state["name"], state["nodes"], state["flows"])
+
+    # returns a copy of the graph sharing its nodes and flows with the original graph
+    # (nodes and flows are never modified once created, refactorings and simplifications
+    #  only add/remove them, so the sets and indexes are the only parts to be copied,
+    #  the compiled version, the alias tables, the structure and the reachability index are shared
+    #  until one of the graphs is modified)
+    def copy(self):
+        newp=BPMNGraph.__new__(BPMNGraph)
+        newp.name=self.name
+        newp.compiled=self.compiled
+        newp.branches=self.branches
+        newp.structure=self.structure
+        newp.reachability=self.reachability
+        newp.nodes=set(self.nodes)
+        newp.flows=set(self.flows)
+        newp.nodesDIC=dict(self.nodesDIC)
+        newp.namesDIC={name: list(tasks) for name, tasks in self.namesDIC.items()}
+        newp.flowsDIC=dict(self.flowsDIC)
+        newp.outDIC={ident: set(fls) for ident, fls in self.outDIC.items()}
+        newp.inDIC={ident: set(fls) for ident, fls in self.inDIC.items()}
+        return newp
+
+    # returns the compiled version of the process (CompiledProcess), which is computed
+    #  the first time and kept until the process is modified
+    def getCompiled(self):
+        if (self.compiled==None):
+            self.compiled=CompiledProcess(self)
+        return self.compiled
+
+    # returns a couple (list of the outgoing flows of an exclusive split, alias table of their
+    #  probabilities, see buildAliasTable), which is computed the first time and kept until the
+    #  process is modified
+    def getBranchTable(self, split):
+        res=self.branches.get(split.getIdent())
+        if (res==None):
+            flows=list(self.getOutgoingFlows(split.getIdent()))
+            res=(flows, buildAliasTable(branchProbabilities(flows)))
+            self.branches[split.getIdent()]=res
+        return res
+
+    # sets the probabilities of the outgoing flows of an exclusive split (dictionary flow ident -> probability)
+    # (flows are replaced, since they may be shared with other processes, see copy)
+    def setBranchProbabilities(self, ident, probs):
+        for f in list(self.getOutgoingFlows(ident)):
+            if (f.getIdent() in probs):
+                self.removeFlow(f.getIdent())
+                self.addFlow(Flow(f.getIdent(), f.getSource(), f.getTarget(), f.getProp(), probs[f.getIdent()]))
+
+    # adds a node to the indexes
+    def indexNode(self, node):
+        self.nodesDIC[node.getIdent()]=node
+        if (node.kind is NodeKind.ACTIVITY):
+            self.namesDIC.setdefault(node.getName(), []).append(node)
+
+    # adds a flow to the indexes
+    def indexFlow(self, flow):
+        self.flowsDIC[flow.getIdent()]=flow
+        self.outDIC.setdefault(flow.getSource().getIdent(), set()).add(flow)
+        self.inDIC.setdefault(flow.getTarget().getIdent(), set()).add(flow)
 
     def addNode(self, node):
         # if not node.getIdent() in [n.getIdent() for n in self._nodes]:
+        self.compiled=None
+        self.branches={}
+        self.structure=None
+        self.reachability=None
         self.nodes.add(node)
+        self.indexNode(node)
 
     def addFlow(self, flow):
         #print("ADD FLOW")
         #flow.print()
+        self.compiled=None
+        self.branches={}
+        self.structure=None
+        self.reachability=None
         self.flows.add(flow)
+        self.indexFlow(flow)
 
     def getNodes(self):
         return self.nodes
@@ -219,9 +568,7 @@ class BPMNGraph:
         return self.name
 
     def getNode(self, ident):
-        for n in self.nodes:
-            if (n.getIdent()==ident):
-                return n
+        return self.nodesDIC.get(ident)
 
     def getNodePrefix(self, ident):
         for n in self.nodes:
@@ -229,65 +576,62 @@ class BPMNGraph:
                 return n
 
     def removeNode(self, ident):
-        nds=set()
-        for n in self.nodes:
-            if (n.getIdent()!=ident):
-                nds.add(n)
-        self.nodes=nds
+        self.compiled=None
+        self.branches={}
+        self.structure=None
+        self.reachability=None
+        n=self.nodesDIC.pop(ident, None)
+        if (n!=None):
+            self.nodes.discard(n)
+            if (n.kind is NodeKind.ACTIVITY):
+                self.namesDIC[n.getName()].remove(n)
 
     def getFlow(self, ident):
-        for f in self.flows:
-            if (f.getIdent()==ident):
-                return f
+        return self.flowsDIC.get(ident)
 
     def removeFlow(self, ident):
-        fls=set()
-        for f in self.flows:
-            if (f.getIdent()!=ident):
-                fls.add(f)
-        self.flows=fls
+        self.compiled=None
+        self.branches={}
+        self.structure=None
+        self.reachability=None
+        f=self.flowsDIC.pop(ident, None)
+        if (f!=None):
+            self.flows.discard(f)
+            self.outDIC[f.getSource().getIdent()].discard(f)
+            self.inDIC[f.getTarget().getIdent()].discard(f)
 
     # returns the flows outgoing of a given node
     def getOutgoingFlows(self, ident):
-        fls=set()
-        for f in self.flows:
-            if (f.getSource().getIdent()==ident):
-                fls.add(f)
-        return fls
+        return set(self.outDIC.get(ident, ()))
 
     # returns the flows incoming to a given node
     def getIncomingFlows(self, ident):
-        fls=set()
-        for f in self.flows:
-            if (f.getTarget().getIdent()==ident):
-                fls.add(f)
-        return fls
+        return set(self.inDIC.get(ident, ()))
 
     # returns the flows incoming to a given node, but only if the source node is a task
     def getIncomingFlowsActivityOnly(self, ident):
         fls=set()
-        for f in self.flows:
-            if (f.getTarget().getIdent()==ident):
-                if (f.getSource().getClass()=="Activity"):
-                    fls.add(f)
+        for f in self.inDIC.get(ident, ()):
+            if (f.getSource().kind is NodeKind.ACTIVITY):
+                fls.add(f)
         return fls
 
     def getActivity(self, name):
-        for n in self.nodes:
-            if (n.getClass()=="Activity") and (n.getName()==name):
-                return n
+        tasks=self.namesDIC.get(name)
+        if tasks:
+            return tasks[0]
 
     # returns the start node of the process
     def getStartNode(self):
         for n in self.nodes:
-            if (n.getClass()=="Start"):
+            if (n.kind is NodeKind.START):
                 return n
 
     # returns the end nodes of the process
     def getEndNodes(self):
         res=set()
         for n in self.nodes:
-            if (n.getClass()=="End"):
+            if (n.kind is NodeKind.END):
                 res.add(n)
         return res
 
@@ -295,7 +639,7 @@ class BPMNGraph:
     def getTasks(self):
         res=set()
         for n in self.nodes:
-            if (n.getClass()=="Activity"):
+            if (n.kind is NodeKind.ACTIVITY):
                 res.add(n)
         return res
 
@@ -303,7 +647,7 @@ class BPMNGraph:
     def getSplits(self):
         res=set()
         for n in self.nodes:
-            if (n.getClass()=="Split"):
+            if (n.kind is NodeKind.SPLIT):
                 res.add(n)
         return res
 
@@ -311,7 +655,7 @@ class BPMNGraph:
     def getJoins(self):
         res=set()
         for n in self.nodes:
-            if (n.getClass()=="Join"):
+            if (n.kind is NodeKind.JOIN):
                 res.add(n)
         return res
 
@@ -319,7 +663,7 @@ class BPMNGraph:
     def getParallelGateways(self):
         res=set()
         for n in self.nodes:
-            if ((n.getClass()=="Split") or (n.getClass()=="Join")) and (n.getType()=="parallel"):
+            if ((n.kind is NodeKind.SPLIT) or (n.kind is NodeKind.JOIN)) and (n.getType()=="parallel"):
                 res.add(n)
         return res
 
@@ -327,27 +671,22 @@ class BPMNGraph:
     def getExclusiveGateways(self):
         res=set()
         for n in self.nodes:
-            if ((n.getClass()=="Split") or (n.getClass()=="Join")) and (n.getType()=="exclusive"):
+            if ((n.kind is NodeKind.SPLIT) or (n.kind is NodeKind.JOIN)) and (n.getType()=="exclusive"):
                 res.add(n)
         return res
 
     # This function returns the successor nodes of a given node
     def getSucc(self, node):
-        flows=self.getFlows()
         succ=[]
-        for f in flows:
-            if (f.getSource().getIdent()==node.getIdent()):
-                # f.print()
-                succ.append(f.getTarget())
+        for f in self.outDIC.get(node.getIdent(), ()):
+            succ.append(f.getTarget())
         return succ
 
     # This function returns the predecessor nodes of a given node
     def getPred(self, node):
-        flows=self.getFlows()
         pred=[]
-        for f in flows:
-            if (f.getTarget().getIdent()==node.getIdent()):
-                pred.append(f.getSource())
+        for f in self.inDIC.get(node.getIdent(), ()):
+            pred.append(f.getSource())
         return pred
 
     # computes the alphabet of the process
@@ -396,14 +735,14 @@ class BPMNGraph:
         #start event
         startnode = self.getStartNode()
         # startdata = {'id': 'start', 'name': 'start event'}
-        startdata = vars(startnode)
+        startdata = dict(id=startnode.getIdent(), name=startnode.getIdent())
         processelem.append(ET.Element(NodeType.START.value, startdata))
 
         #end events
         endnodes = self.getEndNodes()
         #enddata = {'id': 'end1', 'name': 'end event'}
         for endnode in endnodes:
-            enddata = vars(endnode)
+            enddata = dict(id=endnode.getIdent(), name=endnode.getIdent())
             processelem.append(ET.Element(NodeType.END.value, enddata))
 
         # tasks
@@ -477,8 +816,8 @@ class BPMNGraph:
         return res
 
     # computes available resources in the process
-    # we assume one replica per resource type so far
-    # TODO: provide the option to give a different number per resource
+    # nb is the number of replicas of each resource: either the same number for all resources,
+    #  or a dictionary (resource -> nb of replicas), resources not in the dictionary having one replica
     def computeResources(self, nb):
         tasks=self.getTasks()
         res=set()
@@ -486,51 +825,66 @@ class BPMNGraph:
             rset=t.getRes()
             for r in rset:
                 res.add(r)
-        # we finally transform this set into a dictionary with 1 replica by default
+        # we finally transform this set into a dictionary with the nb of replicas of each resource
         finalres={}
         for r in res:
-            finalres[r]=nb
+            if isinstance(nb, dict):
+                finalres[r]=nb.get(r, 1)
+            else:
+                finalres[r]=nb
         return finalres
 
-    # checks whether the resources associated to a task are all available
-    # first parameter is a set of strings
-    # second parameter is a set of couples (res, nbreplicas)
-    def resAvailable (self, res, resources):
-        available=True
+    # checks whether all resources in a list of resources (lres) appear as available in
+    #  a given dictionary of resources (resource -> nb of available replicas)
+    def resAvailable (self, lres, dicres):
+        for r in lres:
+            if (dicres[r]<=0):
+                return False
+        return True
+
+    # checks whether the resources of a task (bitmask, see getResMask) are all available,
+    #  full being the bitmask of the resources without available replica (see updateFullMask)
+    def resAvailableMask (self, mask, full):
+        return not(mask & full)
+
+    # computes the bitmask of the resources without available replica in a dictionary of resources
+    def computeFullMask (self, resources):
+        full=0
+        for r in resources:
+            if (resources[r]<=0):
+                full=full|resourceMask([r])
+        return full
+
+    # updates the bitmask of the resources without available replica (full) after
+    #  the use or release of the resources of a task (res)
+    def updateFullMask (self, res, resources, full):
         for r in res:
-            for key in resources:
-                if (r==key) and (resources[key]<=0):
-                    available=False
-        return available
+            if (resources[r]<=0):
+                full=full|(1<<resourcesDIC[r])
+            else:
+                full=full&~(1<<resourcesDIC[r])
+        return full
 
     # updates resources
     # first parameter is a set of strings
-    # second parameter is a set of couples (res, nbreplicas)
+    # second parameter is a dictionary (resource -> nb of available replicas)
     def updateResources (self, res, resources):
         for r in res:
-            for key in resources:
-                if (r==key):
-                    resources[key]=resources[key]-1
+            resources[r]=resources[r]-1
         return resources
 
     # release resources
     # first parameter is a set of strings (resources of a task)
-    # second parameter is a set of couples (res, nbreplicas)
+    # second parameter is a dictionary (resource -> nb of available replicas)
     def releaseResources (self, res, resources):
         for r in res:
-            for key in resources:
-                if (r==key):
-                    resources[key]=resources[key]+1
+            resources[r]=resources[r]+1
         return resources
 
     # checks whether a ident corresponds to a task
     def isTask(self, ident):
-        tasks=self.getTasks()
-        res=False
-        for t in tasks:
-            if (t.getIdent()==ident):
-                res=True
-        return res
+        n=self.nodesDIC.get(ident)
+        return (n!=None) and (n.kind is NodeKind.ACTIVITY)
 
     # removes a token from the queue of tokens
     def removeToken(self, ident, queue):
@@ -586,7 +940,11 @@ class BPMNGraph:
     # simulation of the process ONCE
     # takes as input the list of resources and available amout (same for all resources now)
     # the verbose parameter is a boolean indicating to print (or not) details about the simulation
-    def simulate(self, nbreplicas, verbose):
+    # the optional analysis parameter (OnlineAnalysis) receives the entries of the simulation
+    #  instead of the log (the returned log is then empty)
+    # the optional chooser parameter (e.g., PathChooser) chooses the outgoing flow of exclusive
+    #  splits (chooser.choose(split, list of flows) returns an index), instead of choosing it randomly
+    def simulate(self, nbreplicas, verbose, analysis=None, chooser=None):
 
         gtime=0
         flows=list(self.getOutgoingFlows(self.getStartNode().getIdent()))
@@ -594,6 +952,8 @@ class BPMNGraph:
         queue=[(flows[0].getIdent(),0)]
         # keeps track of resource usage
         resources=self.computeResources(nbreplicas)
+        # bitmask of the resources without available replica
+        full=self.computeFullMask(resources)
         # keeps track of task status
         taskstatus=self.buildTaskStatus()
 
@@ -623,7 +983,10 @@ class BPMNGraph:
                     print("->", taskstatus[key], end = ' ')
                 print("}\n")
 
-            log.append((gtime, copy.deepcopy(resources), copy.deepcopy(taskstatus)))
+            if (analysis==None):
+                log.append((gtime, copy.deepcopy(resources), copy.deepcopy(taskstatus)))
+            else:
+                analysis.record(gtime, resources, taskstatus)
 
             # if there is identifiers with time 0, move tokens forward
             queuezero=self.getAllTokensToZero(queue)
@@ -651,6 +1014,7 @@ class BPMNGraph:
                         task=self.getNode(c[0])
                         res=task.getRes()
                         resources=self.releaseResources(res, resources)
+                        full=self.updateFullMask(res, resources, full)
                         taskstatus[c[0]]="completed"
                         donesomething=True
 
@@ -660,13 +1024,14 @@ class BPMNGraph:
                         #print(c[0])
                         flow=self.getFlow(c[0])
                         targetnode=flow.getTarget()
-                        if (targetnode.getClass()=="Activity"):
+                        if (targetnode.kind is NodeKind.ACTIVITY):
                             time=targetnode.getTime()
                             res=targetnode.getRes()
                             # check resource availability
-                            if self.resAvailable(res, resources):
+                            if self.resAvailableMask(targetnode.getResMask(), full):
                                 # update resources
                                 resources=self.updateResources(res, resources)
+                                full=self.updateFullMask(res, resources, full)
                                 # updates tokens
                                 queue=self.removeToken(c[0], queue)
                                 queue.append((targetnode.getIdent(),targetnode.getTime()))
@@ -675,17 +1040,20 @@ class BPMNGraph:
                                 # update status of that task
                                 taskstatus[targetnode.getIdent()]="running"
                                 donesomething=True
-                        if (targetnode.getClass()=="End"):
+                        if (targetnode.kind is NodeKind.END):
                             # removes the token, the process terminates
                             queue=self.removeToken(c[0], queue)
                             donesomething=True
-                        if (targetnode.getClass()=="Split"):
+                        if (targetnode.kind is NodeKind.SPLIT):
                             tgw=targetnode.getType()
                             if (tgw=="exclusive"):
                                 queue=self.removeToken(c[0], queue)
-                                flows=list(self.getOutgoingFlows(targetnode.getIdent())) # set of flows
+                                flows, table = self.getBranchTable(targetnode) # list of flows
                                 # print("LEN",len(flows)-1, flows)
-                                randflow=random.randint(0,len(flows)-1)
+                                if (chooser==None):
+                                    randflow=sampleBranch(table, len(flows), random)
+                                else:
+                                    randflow=chooser.choose(targetnode, flows)
                                 queue.append((flows[randflow].getIdent(),0)) # add randomly a token on one flow
                                 queuezero.append((flows[randflow].getIdent(),0))
                                 donesomething=True
@@ -696,7 +1064,7 @@ class BPMNGraph:
                                     queue.append((f.getIdent(),0)) # add a token to each flow
                                     queuezero.append((f.getIdent(),0))
                                 donesomething=True
-                        if (targetnode.getClass()=="Join"):
+                        if (targetnode.kind is NodeKind.JOIN):
                             tgw=targetnode.getType()
                             if (tgw=="exclusive"):
                                 queue=self.removeToken(c[0], queue)
@@ -733,6 +1101,207 @@ class BPMNGraph:
 
         return log
 
+    # checks if there is a token for a given id in the queue which is due at time gtime
+    # (tokens of the event-driven simulation store their absolute completion time)
+    def oneGivenTokenDue(self, queue, ident, gtime):
+        res=False
+        for c in queue:
+            if (c[0]==ident) and (c[1]<=gtime):
+                res=True
+        return res
+
+    # checks whether there is a due token in the queue for each incoming flow
+    def allTokensDueJoinPar(self, targetnode, queue, gtime):
+        flows=self.getIncomingFlows(targetnode.getIdent())
+        res=True
+        for f in flows:
+            if not(self.oneGivenTokenDue(queue, f.getIdent(), gtime)):
+                res=False
+        return res
+
+    # extracts all tokens due at time gtime (in the order of the queue)
+    def getAllTokensDue(self, queue, gtime):
+        queuezero=[]
+        for c in queue:
+            if (c[1]<=gtime):
+                queuezero.append(c)
+        return queuezero
+
+    # simulation of the process ONCE, driven by an event calendar
+    # same parameters and same semantics as the simulate method, but instead of
+    # ticking one time unit at a time, the global time jumps directly to the next
+    # task completion (calendar = heap of completion times), so the cost depends
+    # on the number of events and not on the makespan of the process.
+    # tokens are stored with their absolute completion time (instead of a remaining time).
+    # the log is sparse: an entry (gtime, resources, taskstatus) stands for all the
+    # time units until the next entry, because nothing changes between two events
+    # (see the analyse method)
+    # as for simulate, the optional analysis parameter (OnlineAnalysis) receives the entries instead of the log,
+    #  and the optional chooser parameter chooses the outgoing flows of exclusive splits
+    # the optional sampler parameter (DurationSampler) gives the durations of tasks (their
+    #  mean duration by default), times are then not necessarily integers
+    # returns None if the simulation is blocked (tokens remain, but no task is running, e.g.,
+    #  a parallel join waiting for a token which never comes)
+    def simulateEvents(self, nbreplicas, verbose, analysis=None, chooser=None, sampler=None):
+
+        gtime=0
+        flows=list(self.getOutgoingFlows(self.getStartNode().getIdent()))
+        # keeps track of active tokens (ident, completion time)
+        queue=[(flows[0].getIdent(),0)]
+        # event calendar, completion times of running tasks
+        calendar=[]
+        # keeps track of resource usage
+        resources=self.computeResources(nbreplicas)
+        # bitmask of the resources without available replica
+        full=self.computeFullMask(resources)
+        # keeps track of task status
+        taskstatus=self.buildTaskStatus()
+
+        # logs all information regarding resource usage and task status
+        log=[]
+
+        while (queue!=[]):
+
+            if verbose:
+                # print gtime + status of resources
+                print("TIME =",gtime)
+                print ("RESOURCES = {", end = ' ')
+                for key in resources:
+                    print(key, "->", resources[key], end = ' '),
+                print("}")
+                print ("TOKENS = {", end = ' ')
+                for c in queue:
+                    print(c[0], "->", max(c[1]-gtime,0), end = ' ')
+                print("}")
+                print ("TASK STATUS = {", end = ' ')
+                for key in taskstatus:
+                    print(key, "->", taskstatus[key], end = ' ')
+                print("}\n")
+
+            if (analysis==None):
+                log.append((gtime, copy.deepcopy(resources), copy.deepcopy(taskstatus)))
+            else:
+                analysis.record(gtime, resources, taskstatus)
+
+            # tokens which are due now are moved forward (same rules as in simulate)
+            queuezero=self.getAllTokensDue(queue, gtime)
+            queuenottriggered=[]
+
+            while (queuezero!=[]):
+                c = queuezero[0]
+                queuezero.pop(0)
+
+                donesomething=False
+
+                # check if the token is in a task (end of a task execution)
+                if self.isTask(c[0]):
+                    queue=self.removeToken(c[0], queue)
+                    flows=list(self.getOutgoingFlows(c[0])) # set of flows, but just one in that case
+                    queue.append((flows[0].getIdent(),gtime))
+                    queuezero.append((flows[0].getIdent(),gtime))
+                    task=self.getNode(c[0])
+                    res=task.getRes()
+                    resources=self.releaseResources(res, resources)
+                    full=self.updateFullMask(res, resources, full)
+                    taskstatus[c[0]]="completed"
+                    donesomething=True
+
+                # otherwise, the token is in a flow
+                else:
+                    flow=self.getFlow(c[0])
+                    targetnode=flow.getTarget()
+                    if (targetnode.kind is NodeKind.ACTIVITY):
+                        res=targetnode.getRes()
+                        # check resource availability
+                        if self.resAvailableMask(targetnode.getResMask(), full):
+                            resources=self.updateResources(res, resources)
+                            full=self.updateFullMask(res, resources, full)
+                            queue=self.removeToken(c[0], queue)
+                            if (sampler==None):
+                                duration=targetnode.getTime()
+                            else:
+                                duration=sampler.getDuration(targetnode)
+                            # the completion of the task is registered in the calendar
+                            queue.append((targetnode.getIdent(),gtime+duration))
+                            if (duration==0):
+                                queuezero.append((targetnode.getIdent(),gtime))
+                            else:
+                                heapq.heappush(calendar, gtime+duration)
+                            taskstatus[targetnode.getIdent()]="running"
+                            donesomething=True
+                    if (targetnode.kind is NodeKind.END):
+                        # removes the token, the process terminates
+                        queue=self.removeToken(c[0], queue)
+                        donesomething=True
+                    if (targetnode.kind is NodeKind.SPLIT):
+                        tgw=targetnode.getType()
+                        if (tgw=="exclusive"):
+                            queue=self.removeToken(c[0], queue)
+                            flows, table = self.getBranchTable(targetnode) # list of flows
+                            if (chooser==None):
+                                randflow=sampleBranch(table, len(flows), random)
+                            else:
+                                randflow=chooser.choose(targetnode, flows)
+                            queue.append((flows[randflow].getIdent(),gtime)) # add randomly a token on one flow
+                            queuezero.append((flows[randflow].getIdent(),gtime))
+                            donesomething=True
+                        if (tgw=="parallel"):
+                            queue=self.removeToken(c[0], queue)
+                            flows=self.getOutgoingFlows(targetnode.getIdent()) # set of flows
+                            for f in flows:
+                                queue.append((f.getIdent(),gtime)) # add a token to each flow
+                                queuezero.append((f.getIdent(),gtime))
+                            donesomething=True
+                    if (targetnode.kind is NodeKind.JOIN):
+                        tgw=targetnode.getType()
+                        if (tgw=="exclusive"):
+                            queue=self.removeToken(c[0], queue)
+                            flows=list(self.getOutgoingFlows(targetnode.getIdent())) # set of flows, but just one in that case
+                            queue.append((flows[0].getIdent(),gtime)) # puts a token on the outgoing flow
+                            queuezero.append((flows[0].getIdent(),gtime))
+                            donesomething=True
+                        if (tgw=="parallel"):
+                            if self.allTokensDueJoinPar(targetnode, queue, gtime):
+                                flows=self.getIncomingFlows(targetnode.getIdent())
+                                for f in flows:
+                                    queue=self.removeToken(f.getIdent(), queue)
+                                    queuezero=self.removeToken(f.getIdent(), queuezero)
+                                flows=list(self.getOutgoingFlows(targetnode.getIdent())) # set of flows, but just one in that case
+                                queue.append((flows[0].getIdent(),gtime)) # puts a token on the outgoing flow
+                                queuezero.append((flows[0].getIdent(),gtime))
+                                donesomething=True
+
+                if not(donesomething):
+                    queuenottriggered.append(c)
+                else:
+                    queuezero=queuezero+queuenottriggered
+
+            if (queue==[]):
+                break
+
+            # we jump to the next completion time in the calendar
+            while (calendar!=[]) and (calendar[0]<=gtime):
+                heapq.heappop(calendar)
+            if (calendar==[]):
+                # only blocked tokens remain, nothing can happen anymore
+                if verbose:
+                    print("Warning: no more event, the simulation is blocked.")
+                return None
+            nexttime=calendar[0]
+            # nothing changes until the next event: this entry stands for the
+            # time units between gtime+1 and nexttime-1
+            if (nexttime>gtime+1):
+                if (analysis==None):
+                    log.append((gtime+1, copy.deepcopy(resources), copy.deepcopy(taskstatus)))
+                else:
+                    analysis.record(gtime+1, resources, taskstatus)
+            gtime=nexttime
+
+        if verbose:
+            print("PROCESS COMPLETED!")
+
+        return log
+
     # checks if a tuple (time, ident, resources) is in a log
     def isTupleInLog(self, c, log):
         gt=c[0]
@@ -746,47 +1315,519 @@ class BPMNGraph:
 
     # combines 2 logs, the first one is the final result, the second one is the new one
     # we add a tuple from the second one to the new one, if not already present
-    def combine(self, l1, l2):
+    # the optional index parameter is the set of couples (time, ident) of the tuples in l1,
+    #  it is updated with the added tuples, so that it can be given again to combine
+    #  the following logs without scanning l1 (it is computed if not given)
+    def combine(self, l1, l2, index=None):
         flog=l1
+        if (index==None):
+            index=set()
+            for c in l1:
+                index.add((c[0], c[1]))
         for c in l2:
-            if not(self.isTupleInLog(c, l1)):
+            key=(c[0], c[1])
+            if not(key in index):
+                index.add(key)
                 flog.append(c)
         return flog
 
+    # simulation of the process ONCE followed by its analysis
+    # returns a couple (execution time, tasks that could have been executed earlier)
+    # if seed is not None, the random generator is initialised with it before the simulation
+    # the analysis is done during the simulation (OnlineAnalysis), unless snapshots is True:
+    #  in that case, the full log is built (one copy of resources and task status per entry)
+    #  and analysed at the end
+    # the optional chooser parameter chooses the outgoing flows of exclusive splits (see simulate)
+    # the optional sampler parameter (DurationSampler) gives the durations of tasks with random
+    #  durations (see Duration), by default they are drawn with the random module; such processes
+    #  are simulated in continuous time (the "tick" engine is then replaced by the "event" one)
+    # the execution time of a blocked simulation (see simulateEvents) is infinite, so that a
+    #  blocked process is never better than another one
+    def simulateOnce(self, nbreplicas, verbose, engine="tick", seed=None, snapshots=False, chooser=None, sampler=None):
+        if (seed!=None):
+            random.seed(seed)
+        if (sampler==None) and self.hasStochasticDurations():
+            sampler=DurationSampler(None, 0)
+        if (sampler!=None) and (engine=="tick"):
+            engine="event"
+        if snapshots:
+            analysis=None
+        else:
+            analysis=OnlineAnalysis(self)
+        if (engine=="compiled") and (analysis!=None) and not(verbose):
+            return self.getCompiled().simulate(nbreplicas, chooser, sampler)
+        if (engine=="event") or (engine=="compiled"):
+            log=self.simulateEvents(nbreplicas, verbose, analysis, chooser, sampler)
+            if (log==None):
+                return (float("inf"), [])
+        else:
+            log=self.simulate(nbreplicas, verbose, analysis, chooser)
+        if (analysis!=None):
+            return (analysis.getEndTime(), analysis.getResult())
+        # this is the global time of the last entry in the log
+        return (log[len(log)-1][0], self.analyse(log))
+
     # simulation of the process ONCE
     # takes as input the list of resources and available amout (same for all resources now)
     # the verbose parameter is a boolean indicating to print (or not) details about the simulation
     # takes a last parameter corresponding to the number of simulations
     # We also compute and print the average execution time (if verbose) !
-    def simulateANDanalyse(self, nbreplicas, verbose, snumber):
-        ind=snumber
+    # the optional engine parameter selects the simulator
+    #  ("tick" = simulate, one time unit per step, "event" = simulateEvents, jumps from one event to the next,
+    #   "compiled" = same as "event", on the compiled version of the process (see CompiledProcess),
+    #   "exact" = all the possible executions are simulated once, see computeExactAnalysis,
+    #   the other parameters are then used only if the exact analysis is not possible,
+    #   "batch" = the snumber simulations are run together, see simulateBatch, nbworkers and ciwidth are not used,
+    #   it is replaced by "compiled" if streams are given)
+    # the optional nbworkers parameter spreads the simulations over a pool of nbworkers processes
+    #  (created only if there is more than one simulation to run)
+    # the optional seed parameter makes the simulations deterministic: simulation number i
+    #  (starting from 0) is run with seed+i, so that the resulting log and average execution
+    #  time do not depend on nbworkers (if seed is None and nbworkers>1, seed is drawn randomly),
+    #  and the state of the random module is restored after the simulations
+    # the optional cache parameter (SimulationCache) allows to reuse the result computed
+    #  before for the same process (up to identifiers), nbreplicas, snumber and seed
+    # the optional snapshots parameter keeps the full log of each simulation (see simulateOnce),
+    #  by default simulations are analysed on the fly
+    # if the process has no random choice (isDeterministic), all simulations are identical and
+    #  the process is simulated once only, and if moreover no task can wait for resources
+    #  (isContentionFree), the result is computed from the start times of tasks (computeAnalyticalAnalysis)
+    # the optional ciwidth parameter enables an adaptive number of simulations: simulations
+    #  stop as soon as the confidence interval (with the given confidence level) of the
+    #  average execution time is narrower than ciwidth (snumber is then the max number of simulations)
+    # the optional streams parameter (ChoiceStreams) gives the choices of exclusive splits:
+    #  simulation number i uses the i-th stream of each split (see StreamChooser), so that
+    #  processes simulated with the same streams are compared with the same random choices
+    # if some tasks have random durations (see Duration), the durations of all the simulations are
+    #  drawn by blocks with NumPy (see DurationSamples): simulation number i uses row i, so that
+    #  the durations depend on the seed (or on the seed of the streams) but not on nbworkers
+    # the optional loops parameter selects how loops are handled ("simulate" = loops are simulated,
+    #  iteration after iteration, "collapse" = each loop is replaced by a task whose duration is the
+    #  expected duration of the loop, see computeLoopFreeProcess, the tasks of loops are then not
+    #  in the resulting log), and the optional maxiterations parameter bounds the number of
+    #  iterations of each loop (see LoopChooser, the "batch" engine is then replaced by "compiled")
+    def simulateANDanalyse(self, nbreplicas, verbose, snumber, engine="tick", nbworkers=1, seed=None, cache=None, snapshots=False, ciwidth=None, confidence=0.95, streams=None, loops="simulate", maxiterations=None):
+        if (loops=="collapse"):
+            loopfreep, macros = self.computeLoopFreeProcess(maxiterations)
+            if (macros!={}):
+                res=loopfreep.simulateANDanalyse(nbreplicas, verbose, snumber, engine, nbworkers, seed, cache, snapshots, ciwidth, confidence, streams)
+                return ([c for c in res[0] if not(c[1] in macros)], res[1])
+
+        # back flows of the loops whose number of iterations is bounded
+        loopflows=None
+        if (maxiterations!=None):
+            for ident in self.computeBackFlows():
+                loopsplit=self.computeLoopSplit(ident)
+                if (loopsplit!=None):
+                    if (loopflows==None):
+                        loopflows={}
+                    loopflows.setdefault(loopsplit[0].getIdent(), set()).add(loopsplit[1].getIdent())
+            if (loopflows!=None) and (engine=="batch"):
+                engine="compiled"
+
+        # if no task can wait for resources, the result is computed without simulation
+        #  (unless details of the simulation are required)
+        if not(verbose) and not(snapshots) and self.isContentionFree(nbreplicas):
+            return self.computeAnalyticalAnalysis()
+
+        if (engine=="exact"):
+            # the result depends neither on the number of simulations nor on the seed
+            if (cache!=None):
+                centry=cache.prepare(self, nbreplicas, "exact", None, engine)
+                cres=cache.get(centry)
+                if (cres!=None):
+                    return cres
+            res=self.computeExactAnalysis(nbreplicas, verbose, snapshots=snapshots)
+            if (res!=None):
+                if (cache!=None):
+                    cache.put(centry, res)
+                return res
+            engine="event"
+
+        if (streams!=None):
+            # the choices only depend on the streams
+            seed=None
+            # the batch engine draws its own choices, it cannot use the streams
+            if (engine=="batch"):
+                engine="compiled"
+        if (cache!=None):
+            # the bound of the number of iterations is part of the key
+            csnumber=snumber if (loopflows==None) else (snumber, maxiterations)
+            if (streams!=None):
+                centry=cache.prepare(self, nbreplicas, csnumber, ("streams", streams.seed), engine, ciwidth, confidence)
+            else:
+                centry=cache.prepare(self, nbreplicas, csnumber, seed, engine, ciwidth, confidence)
+            cres=cache.get(centry)
+            if (cres!=None):
+                return cres
+
+        # order of the outgoing flows of exclusive splits, used to interpret the streams
+        branchorder=None
+        if (streams!=None):
+            branchorder=self.computeBranchOrder()
+
+        if (engine=="batch"):
+            res=self.simulateBatch(nbreplicas, snumber, seed)
+            if (res!=None):
+                endtimes, logs = res
+                fres=[]
+                findex=set()
+                combined=set()  # logs already combined (simulations with the same choices share their log)
+                for log in logs:
+                    if not(id(log) in combined):
+                        combined.add(id(log))
+                        fres=self.combine(fres, log, findex)
+                tres=float(endtimes.mean())
+                if verbose:
+                    print("RESULTING LOG =", fres)
+                    print("AVERAGE EXECUTION TIME =", tres)
+                if (cache!=None):
+                    cache.put(centry, (fres, tres))
+                return (fres, tres)
+            engine="event"
+
+        if (seed==None) and (nbworkers>1) and (streams==None):
+            seed=random.randrange(2**32)
+        if (seed==None):
+            seeds=[None]*snumber
+        else:
+            seeds=[seed+i for i in range(snumber)]
+        if self.isDeterministic():
+            seeds=seeds[:1]
+
+        # durations of the tasks with random durations
+        samples=None
+        if self.hasStochasticDurations() and (np!=None):
+            if (streams!=None):
+                samples=DurationSamples(streams.seed, len(seeds))
+            elif (seed!=None):
+                samples=DurationSamples(seed, len(seeds))
+            else:
+                samples=DurationSamples(random.randrange(2**32), len(seeds))
+
+        # in adaptive mode, simulations are run by batches (one simulation per worker), the
+        #  confidence interval being checked after each batch (and after a few simulations first)
+        if (ciwidth==None):
+            batch=len(seeds)
+        else:
+            batch=nbworkers
+            minruns=min(len(seeds), max(MINRUNS, nbworkers))
+
+        parallel=(nbworkers>1) and (len(seeds)>1)
+        # the workers of the pool are stopped when leaving the with block (also if a worker raises an exception)
+        if parallel:
+            pool=multiprocessing.Pool(nbworkers, initReplicaWorker, (self, nbreplicas, verbose, engine, snapshots, streams, branchorder, samples, loopflows, maxiterations))
+        else:
+            pool=contextlib.nullcontext()
+        # simulateOnce seeds the random module with the seed of each simulation, the state of
+        #  the random module of the caller is kept
+        if (seed!=None):
+            state=random.getstate()
+        with pool:
+            runs=[]
+            while (len(runs)<len(seeds)):
+                # couples (seed, simulation number)
+                if (ciwidth==None):
+                    nextjobs=list(zip(seeds, range(len(seeds))))
+                else:
+                    nextjobs=list(zip(seeds, range(len(seeds))))[len(runs):max(len(runs)+batch, minruns)]
+                if parallel:
+                    runs.extend(pool.map(simulateReplica, nextjobs, chunksize=max(1, len(nextjobs)//(4*nbworkers))))
+                else:
+                    for job in nextjobs:
+                        chooser=None
+                        if (streams!=None):
+                            chooser=StreamChooser(streams, job[1], branchorder)
+                        if (loopflows!=None):
+                            chooser=LoopChooser(self, loopflows, maxiterations, chooser)
+                        sampler=None
+                        if (samples!=None):
+                            sampler=DurationSampler(samples, job[1])
+                        runs.append(self.simulateOnce(nbreplicas, verbose, engine, job[0], snapshots, chooser, sampler))
+                if (ciwidth!=None) and (len(runs)>=minruns):
+                    if (self.confidenceWidth([run[0] for run in runs], confidence)<=ciwidth):
+                        break
+        if (seed!=None):
+            random.setstate(state)
+
         fres=[]
+        findex=set()    # couples (time, ident) of the tuples in fres
         cumulatedtime=0
-        while (ind>0):
-            log=self.simulate(nbreplicas, verbose)
-            # print(log[len(log)-1][0])
-            # this is the global time of the last entry in the log
-            cumulatedtime=cumulatedtime+log[len(log)-1][0]
-            res=self.analyse(log)
-            ind=ind-1
-            fres=self.combine(fres, res)
+        for run in runs:
+            cumulatedtime=cumulatedtime+run[0]
+            fres=self.combine(fres, run[1], findex)
             # print(res)
-        tres=cumulatedtime/snumber
+        tres=cumulatedtime/len(runs)
+        if verbose and (len(runs)<snumber):
+            print("Nb of simulations =", len(runs))
         if verbose:
             print("RESULTING LOG =", fres)
             print("AVERAGE EXECUTION TIME =", tres)
+        if (cache!=None):
+            cache.put(centry, (fres, tres))
         return (fres, tres)
 
 
-    # checks whether all resources in a list of resources (lres) appear as available in
-    #  a given dictionary of resources
-    def resAvailable (self, lres, dicres):
-        res=True
-        for r in lres:
-            if (dicres[r]<=0):
-                res=False
+    # computes the exact analysis of the process: instead of choosing randomly the outgoing
+    #  flows of exclusive splits, all the possible combinations of choices are enumerated
+    #  (depth-first, see PathChooser), and each possible execution is simulated once (with the
+    #  compiled version of the process), its probability being the product of the probabilities
+    #  of its choices (see branchProbabilities)
+    # returns the same couple as simulateANDanalyse (all the tasks that could have been
+    #  executed earlier in at least one execution, expected execution time), or None
+    #  if the process contains a loop (infinitely many executions) or more than maxpaths executions,
+    #  or tasks with random durations
+    def computeExactAnalysis(self, nbreplicas, verbose, maxpaths=10000, snapshots=False):
+        if self.hasStochasticDurations():
+            if verbose:
+                print("Warning: there are random durations, the exact analysis is not possible.")
+            return None
+        if (len(self.computeBackFlows())>0):
+            if verbose:
+                print("Warning: there is a loop, the exact analysis is not possible.")
+            return None
+
+        fres=[]
+        findex=set()    # couples (time, ident) of the tuples in fres
+        exptime=0
+        nbpaths=0
+        # prefixes of choices still to be simulated, with the probability of these choices
+        tobesimulated=[([], 1.0)]
+        while (tobesimulated!=[]):
+            if (nbpaths>=maxpaths):
+                if verbose:
+                    print("Warning: more than", maxpaths, "executions, the exact analysis is stopped.")
+                return None
+            prefix, prob = tobesimulated.pop()
+            chooser=PathChooser(prefix)
+            run=self.simulateOnce(nbreplicas, False, "compiled", None, snapshots, chooser)
+            nbpaths=nbpaths+1
+            # the choices made after the prefix (first possible flow each time) give new prefixes
+            #  for the other flows (flows with a zero probability are never taken)
+            for k in range(len(prefix), len(chooser.taken)):
+                for i in range(chooser.arities[k]):
+                    if (i!=chooser.taken[k]) and (chooser.getBranchProbability(k, i)>0):
+                        tobesimulated.append((chooser.taken[:k]+[i], prob*chooser.getProbability(k)*chooser.getBranchProbability(k, i)))
+            prob=prob*chooser.getProbability(len(chooser.taken))
+            exptime=exptime+prob*run[0]
+            fres=self.combine(fres, run[1], findex)
+
+        if verbose:
+            print("Nb of executions =", nbpaths)
+            print("RESULTING LOG =", fres)
+            print("EXPECTED EXECUTION TIME =", exptime)
+        return (fres, exptime)
+
+    # checks whether the execution of the process does not depend on resources nor on random choices:
+    #  no exclusive gateway, no loop, and each resource has at least as many replicas as tasks using it,
+    #  so that a task never waits for a resource (and its resources are always available when it waits),
+    #  and no random duration
+    def isContentionFree(self, nbreplicas):
+        if (len(self.getExclusiveGateways())>0) or (len(self.computeBackFlows())>0):
+            return False
+        if self.hasStochasticDurations():
+            return False
+        resources=self.computeResources(nbreplicas)
+        users={}
+        for t in self.getTasks():
+            for r in t.getRes():
+                users[r]=users.get(r,0)+1
+        for r in users:
+            if (resources[r]<users[r]):
+                return False
+        return True
+
+    # computes the start time of each task of a process without exclusive gateways nor loops,
+    #  when no task waits for resources (longest path from the start node, in topological order)
+    # returns a couple (dictionary task ident -> start time, end time of the process)
+    def computeStartTimes(self):
+        ready={}        # node ident -> time when all its incoming tokens are there
+        nbinc={}        # node ident -> number of incoming flows not handled yet
+        for n in self.getNodes():
+            nbinc[n.getIdent()]=len(self.getIncomingFlows(n.getIdent()))
+        start=self.getStartNode()
+        ready[start.getIdent()]=0
+        tovisit=[start]
+        starttimes={}
+        endtime=0
+        while (tovisit!=[]):
+            node=tovisit.pop()
+            time=ready[node.getIdent()]
+            if (node.getClass()=="Activity"):
+                starttimes[node.getIdent()]=time
+                time=time+node.getTime()
+            if (node.getClass()=="End"):
+                endtime=max(endtime, time)
+            for n in self.getSucc(node):
+                ready[n.getIdent()]=max(ready.get(n.getIdent(), 0), time)
+                nbinc[n.getIdent()]=nbinc[n.getIdent()]-1
+                if (nbinc[n.getIdent()]==0):
+                    tovisit.append(n)
+        return (starttimes, endtime)
+
+    # computes the analysis of a process for which isContentionFree holds, without simulation:
+    #  the result is the same as the one of simulateANDanalyse (all the simulations are identical),
+    #  each task waits (with its resources available) from time unit 1 to the time unit of its start time (see timeUnits), until the
+    #  end of the process (the first and last entries of the log are not analysed, see analyse)
+    def computeAnalyticalAnalysis(self):
+        starttimes, endtime = self.computeStartTimes()
+        tasks=[]
+        for key in self.buildTaskStatus():
+            tasks.append((key, starttimes[key], self.getNode(key).getRes()))
+        restasks=[]
+        for time in timeUnits(1, endtime):
+            for t in tasks:
+                if (time<=math.ceil(t[1])):
+                    restasks.append((time, t[0], t[2]))
+        return (restasks, endtime)
+
+    # computes, for each exclusive split, the rank of each outgoing flow (dictionary split ident ->
+    #  dictionary flow ident -> rank), in an order which does not depend on the identifiers of flows,
+    #  so that the branches of a split are in the same order in all the refactorings of a process:
+    #  flows are sorted by the names of the tasks reachable from their target node, except the tasks
+    #  reachable from all the outgoing flows of the split (those after the merge, for instance)
+    def computeBranchOrder(self):
+        res={}
+        for split in self.getSplits():
+            if (split.getType()=="exclusive"):
+                flows=list(self.getOutgoingFlows(split.getIdent()))
+                reached={}
+                for f in flows:
+                    names=set()
+                    visited=set()
+                    tovisit=[f.getTarget()]
+                    while (tovisit!=[]):
+                        n=tovisit.pop()
+                        if not(n.getIdent() in visited):
+                            visited.add(n.getIdent())
+                            if (n.getClass()=="Activity"):
+                                names.add(n.getName())
+                            tovisit.extend(self.getSucc(n))
+                    reached[f.getIdent()]=names
+                common=set.intersection(*reached.values())
+                keys=[]
+                for f in flows:
+                    keys.append((sorted(reached[f.getIdent()]-common), f.getIdent()))
+                keys.sort()
+                ranks={}
+                for i in range(len(keys)):
+                    ranks[keys[i][1]]=i
+                res[split.getIdent()]=ranks
         return res
 
+    # runs nbsim simulations of the process together (NumPy is required): the choices of exclusive
+    #  splits of all the simulations are drawn at once (matrix of random numbers, one row per
+    #  simulation, see BatchChooser), and simulations making the same choices are simulated
+    #  only once (with the compiled version of the process), so that the cost depends on the
+    #  number of different executions, and not on the number of simulations
+    # if some tasks have random durations, their durations are drawn at once as well (see
+    #  DurationSamples), but each simulation is then simulated on its own
+    # returns a couple (array of the nbsim execution times, list of the nbsim analysis logs),
+    #  or None if NumPy is not available
+    def simulateBatch(self, nbreplicas, nbsim, seed=None):
+        if (np==None):
+            print("Warning: NumPy is not available, simulations cannot be run in batch.")
+            return None
+        if (seed==None):
+            seed=random.randrange(2**32)
+        choices=BatchChoices(np.random.default_rng(seed), nbsim)
+        endtimes=np.zeros(nbsim)
+        logs=[None]*nbsim
+        # groups of simulations still to be simulated, with the choices they share
+        samples=None
+        if self.hasStochasticDurations():
+            samples=DurationSamples(seed, nbsim)
+            tobesimulated=[([], np.arange(i, i+1)) for i in range(nbsim)]
+        else:
+            tobesimulated=[([], np.arange(nbsim))]
+        while (tobesimulated!=[]):
+            prefix, rows = tobesimulated.pop()
+            chooser=BatchChooser(choices, prefix, rows)
+            sampler=None
+            if (samples!=None):
+                sampler=DurationSampler(samples, int(rows[0]))
+            run=self.simulateOnce(nbreplicas, False, "compiled", None, False, chooser, sampler)
+            endtimes[chooser.rows]=run[0]
+            for r in chooser.rows:
+                logs[r]=run[1]
+            tobesimulated.extend(chooser.others)
+        return (endtimes, logs)
+
+    # simulation of several cases (instances) of the process competing for the same resources
+    #  (nbreplicas is the nb of replicas of resources, see computeResources)
+    # cases arrive either at the times given in arrivals (a list of times, e.g., from a trace),
+    #  or randomly (Poisson process) with the given rate (mean nb of arrivals per time unit),
+    #  nbcases cases being then generated (the first one at time 0)
+    # returns a dictionary with the number of completed cases, the throughput (completed cases
+    #  per time unit, between the first arrival and the last completion, 0 if no time elapsed),
+    #  the average cycle time (time between the arrival and the completion of a case), nearest-rank
+    #  percentiles of cycle times (dictionary p -> time), and the utilization of each resource (part of the time during
+    #  which its replicas are used)
+    def simulateCases(self, nbreplicas, nbcases=1000, rate=1.0, arrivals=None, seed=None, verbose=False):
+        rng=random.Random(seed)
+        if (arrivals==None):
+            arrivals=[0]
+            for i in range(1, nbcases):
+                arrivals.append(arrivals[i-1]+rng.expovariate(rate))
+        else:
+            arrivals=sorted(arrivals)
+        compiled=self.getCompiled()
+        cases, busy = compiled.simulateCases(nbreplicas, arrivals, rng)
+
+        cycletimes=[]
+        lastend=arrivals[0] if (arrivals!=[]) else 0
+        for c in cases:
+            if (c!=None):
+                cycletimes.append(c[1]-c[0])
+                lastend=max(lastend, c[1])
+        cycletimes.sort()
+        duration=lastend-(arrivals[0] if (arrivals!=[]) else 0)
+        res={}
+        res["cases"]=len(cycletimes)
+        res["throughput"]=len(cycletimes)/duration if (duration>0) else 0.0
+        res["cycletime"]=sum(cycletimes)/len(cycletimes) if (cycletimes!=[]) else 0
+        res["percentiles"]={}
+        # nearest-rank percentiles: the smallest cycle time such that p% of the cycle times are lower or equal
+        for p in [50, 90, 95, 99]:
+            if (cycletimes!=[]):
+                res["percentiles"][p]=cycletimes[max(0, math.ceil(p*len(cycletimes)/100)-1)]
+        capacities=self.computeResources(nbreplicas)
+        res["utilization"]={}
+        for i in range(len(compiled.resources)):
+            r=compiled.resources[i]
+            if (duration>0) and (capacities[r]>0):
+                res["utilization"][r]=busy[i]/(capacities[r]*duration)
+        if verbose:
+            print("NB OF COMPLETED CASES =", res["cases"], "/", len(arrivals))
+            print("THROUGHPUT =", res["throughput"])
+            print("AVERAGE CYCLE TIME =", res["cycletime"])
+            print("CYCLE TIME PERCENTILES =", res["percentiles"])
+            print("RESOURCE UTILIZATION =", res["utilization"])
+        return res
+
+    # checks whether the process has no random choice (no exclusive split) nor random duration,
+    #  in that case all the simulations of the process give the same result
+    def isDeterministic(self):
+        for n in self.getSplits():
+            if (n.getType()=="exclusive"):
+                return False
+        return not(self.hasStochasticDurations())
+
+    # checks whether some tasks of the process have random durations (see Duration)
+    def hasStochasticDurations(self):
+        for t in self.getTasks():
+            if t.isStochastic():
+                return True
+        return False
+
+    # computes the width of the confidence interval of the average of a list of values
+    #  (normal approximation, confidence is the confidence level)
+    def confidenceWidth(self, values, confidence):
+        if (len(values)<2):
+            return float("inf")
+        z=statistics.NormalDist().inv_cdf((1+confidence)/2)
+        return 2*z*statistics.stdev(values)/(len(values)**0.5)
+
     # this method removes from the log all tasks that are not executed during
     # the simulation, because they may make erroneous the results
     def purge(self, log):
@@ -814,6 +1855,8 @@ class BPMNGraph:
     # analyses the execution log to identify all tasks that can be executed earlier
     # a task can be executed earlier if a task is in the "waiting" state and
     #  all required resources for this task are available
+    # an entry of the log stands for all the time units until the next entry
+    #  (one single time unit for the logs of simulate, possibly more for those of simulateEvents)
     def analyse(self, log):
         restasks=[]
         # print("LOG",log)
@@ -825,21 +1868,27 @@ class BPMNGraph:
         log=self.purge(log)
         # self.purge(log)
 
-        for entry in log[1:len(log)-1]: # we skip gtime 0 where all resources are still available
-            time=entry[0]
+        for i in range(1, len(log)-1): # we skip gtime 0 where all resources are still available
+            entry=log[i]
             resources=entry[1]
             tasks=entry[2]
-            for key in tasks:
-                if (tasks[key]=="waiting"):
-                    res=self.getNode(key).getRes()
-                    if self.resAvailable(res, resources):
-                        restasks.append((time, key, res))
+            for time in timeUnits(entry[0], log[i+1][0]):
+                for key in tasks:
+                    if (tasks[key]=="waiting"):
+                        res=self.getNode(key).getRes()
+                        if self.resAvailable(res, resources):
+                            restasks.append((time, key, res))
         return restasks
 
 
     # This method returns the split node corresponding to the given merge/join node
-    # Assumption: workflow is balanced
+    # (None if there is none, see computeStructure)
     def getSplitNode(self, mergenode):
+        return self.getStructure()[1].get(mergenode.getIdent())
+
+    # previous version of getSplitNode, walking the process back from the merge node
+    # Assumption: workflow is balanced
+    def getSplitNodeWalk(self, mergenode):
         res=self.getSplitNodeAux(mergenode, mergenode, [], -1)
         return res
 
@@ -869,11 +1918,145 @@ class BPMNGraph:
 
 
     # This method returns the merge node corresponding to the given split node
-    # Assumption: workflow is balanced
+    # (None if there is none, see computeStructure)
     def getMergeNode(self, splitnode):
+        return self.getStructure()[0].get(splitnode.getIdent())
+
+    # previous version of getMergeNode, walking the process from the split node
+    # Assumption: workflow is balanced
+    def getMergeNodeWalk(self, splitnode):
         res=self.getMergeNodeAux(splitnode, splitnode, [], 1)
         return res
 
+    # computes the immediate dominator of each node of the process (or its immediate post-dominator
+    #  if post is True), loops being cut by back flows (see computeBackFlows): the start node (or the
+    #  end nodes) are the children of a virtual root, represented by None
+    # iterative algorithm of Cooper, Harvey and Kennedy, in reverse postorder
+    # returns a dictionary node ident -> ident of the immediate (post-)dominator, or None for the root
+    #  (nodes which are not reachable from the root are not in the dictionary)
+    def computeDominators(self, post=False):
+        back=self.computeBackFlows()
+        succ={}
+        pred={}
+        for n in self.getNodes():
+            succ[n.getIdent()]=[]
+            pred[n.getIdent()]=[]
+        for f in self.getFlows():
+            if not(f.getIdent() in back):
+                source=f.getSource().getIdent()
+                target=f.getTarget().getIdent()
+                if post:
+                    source, target = target, source
+                succ[source].append(target)
+                pred[target].append(source)
+        if post:
+            roots=[n.getIdent() for n in self.getNodes() if (n.kind is NodeKind.END)]
+        else:
+            roots=[self.getStartNode().getIdent()]
+        succ[None]=roots
+        for r in roots:
+            pred[r].append(None)
+
+        # postorder numbers (the root has the highest one)
+        number={}
+        order=[]
+        visited=set([None])
+        stack=[(None, iter(roots))]
+        while (stack!=[]):
+            node, it = stack[-1]
+            child=next(it, False)
+            if (child is False):
+                stack.pop()
+                number[node]=len(order)
+                order.append(node)
+            elif not(child in visited):
+                visited.add(child)
+                stack.append((child, iter(succ[child])))
+
+        idom={None: None}
+        changed=True
+        while changed:
+            changed=False
+            for node in reversed(order[:-1]):
+                # predecessors already handled
+                handled=[p for p in pred[node] if (p in idom)]
+                new=handled[0]
+                for p in handled[1:]:
+                    # intersection of the dominators of p and new
+                    a=p
+                    b=new
+                    while (a!=b):
+                        while (number[a]<number[b]):
+                            a=idom[a]
+                        while (number[b]<number[a]):
+                            b=idom[b]
+                    new=a
+                if not(node in idom) or (idom[node]!=new):
+                    idom[node]=new
+                    changed=True
+        del idom[None]
+        return idom
+
+    # checks whether node a (ident) is an ancestor of node b (ident) in a tree of dominators (see computeDominators)
+    def isDominatorInTree(self, tree, a, b):
+        while (b!=None):
+            if (b==a):
+                return True
+            b=tree.get(b)
+        return False
+
+    # computes the matching of split and merge nodes, that is, the single-entry single-exit regions
+    #  of the process starting with a split and ending with a join: the merge of a split is its
+    #  immediate post-dominator (the first node where all its branches meet), if it is a join, the
+    #  split dominates it, and each node between them is dominated by the split and post-dominated
+    #  by the merge (no other way in or out), so that unbalanced parts are not matched
+    # the exit split and the merge of a loop (see computeLoops) are not matched (the merge of a
+    #  loop is upstream of its split, so that they do not delimit a region)
+    # returns a couple (dictionary split ident -> merge node, dictionary merge ident -> split node)
+    def computeStructure(self):
+        ipdom=self.computeDominators(True)
+        idom=self.computeDominators(False)
+        back=self.computeBackFlows()
+        loopnodes=set()
+        for l in self.computeLoops():
+            loopnodes.add(l[0].getIdent())
+            loopnodes.add(l[1].getIdent())
+        merges={}
+        splits={}
+        for n in self.getSplits():
+            m=ipdom.get(n.getIdent())
+            if (n.getIdent() in loopnodes) or (m in loopnodes):
+                continue
+            if (m==None) or (self.getNode(m).kind is not NodeKind.JOIN) or not(self.isDominatorInTree(idom, n.getIdent(), m)):
+                continue
+            region=True
+            visited=set([n.getIdent(), m])
+            tovisit=[f.getTarget().getIdent() for f in self.getOutgoingFlows(n.getIdent()) if not(f.getIdent() in back)]
+            while (tovisit!=[]) and region:
+                ident=tovisit.pop()
+                if not(ident in visited):
+                    visited.add(ident)
+                    if not(self.isDominatorInTree(idom, n.getIdent(), ident)) or not(self.isDominatorInTree(ipdom, m, ident)):
+                        region=False
+                    for f in self.getOutgoingFlows(ident):
+                        if not(f.getIdent() in back):
+                            tovisit.append(f.getTarget().getIdent())
+            if region:
+                merges[n.getIdent()]=self.getNode(m)
+        for ident in merges:
+            m=merges[ident].getIdent()
+            # the split of a merge is the closest one (for nested regions ending with the same merge)
+            if not(m in splits) or self.isDominatorInTree(idom, splits[m].getIdent(), ident):
+                splits[m]=self.getNode(ident)
+        return (merges, splits)
+
+    # returns the matching of split and merge nodes (see computeStructure), which is computed the
+    #  first time and kept until the process is modified
+    def getStructure(self):
+        if (self.structure==None):
+            self.structure=self.computeStructure()
+        return self.structure
+
     def getMergeNodeAux(self, splitnode, current, visited, depth):
         if not (current.getIdent() in visited):
             # print("CURRENT", current.getIdent(), depth)
@@ -970,7 +2153,7 @@ class BPMNGraph:
             counter=counter+1
             # update incoming flow of pred (it should go to g1)
             f1=list(currentp.getIncomingFlows(pred.getIdent()))[0]
-            newp.addFlow(Flow("fref"+str(counter), f1.getSource(), g1))
+            newp.addFlow(Flow("fref"+str(counter), f1.getSource(), g1, prob=f1.getProb()))
             counter=counter+1
             newp.removeFlow(f1.getIdent())
             # update outgoing flow of t (it should go out from g2)
@@ -1004,7 +2187,7 @@ class BPMNGraph:
             counter=counter+1
             # update incoming flow of pred (it should go to g1)
             f1=list(currentp.getIncomingFlows(splitnode.getIdent()))[0]  # DIFFERENT !
-            newp.addFlow(Flow("fref"+str(counter), f1.getSource(), g1))
+            newp.addFlow(Flow("fref"+str(counter), f1.getSource(), g1, prob=f1.getProb()))
             counter=counter+1
             newp.removeFlow(f1.getIdent())
             # update outgoing flow of t (it should go out from g2)
@@ -1045,7 +2228,7 @@ class BPMNGraph:
                 counter=counter+1
                 # update incoming flow of pred (it should go to g1)
                 f1=list(currentp.getIncomingFlows(predtask.getIdent()))[0]  # DIFFERENT !
-                newp.addFlow(Flow("fref"+str(counter), f1.getSource(), g1))
+                newp.addFlow(Flow("fref"+str(counter), f1.getSource(), g1, prob=f1.getProb()))
                 counter=counter+1
                 newp.removeFlow(f1.getIdent())
                 # update outgoing flow of mergenode (it should go out from g2)
@@ -1073,16 +2256,16 @@ class BPMNGraph:
     # caution: a node is taken into account only if it is a task
     def noSharedResources(self, proc, node, node2):
 
-        allres=set()
+        allres=0
         incf=proc.getIncomingFlows(node.getIdent())
         for f in incf:
             source=f.getSource()
             #print(source.getIdent())
             #print(source.getRes())
             if (source.getClass()=="Activity"):
-                allres=allres.union(source.getRes())
+                allres=allres|source.getResMask()
         # print (allres)
-        return (len(node2.getRes().intersection(allres))==0)
+        return not(node2.getResMask() & allres)
 
     # computes the set of tasks preceding 'node' with resources shared with node2
     # if a node is not a task, it is not considered
@@ -1093,7 +2276,7 @@ class BPMNGraph:
         for f in incf:
             source=f.getSource()
             if (source.getClass()=="Activity"):
-                if (len(source.getRes().intersection(node2.getRes()))>0):
+                if (source.getResMask() & node2.getResMask()):
                     res.add(source)
         return res
 
@@ -1145,7 +2328,7 @@ class BPMNGraph:
             counter=counter+1
             # update incoming flow of pred (it should go to g1)
             f1=list(currentp.getIncomingFlows(pred.getIdent()))[0]
-            newp.addFlow(Flow("fref"+str(counter), f1.getSource(), g1))
+            newp.addFlow(Flow("fref"+str(counter), f1.getSource(), g1, prob=f1.getProb()))
             counter=counter+1
             newp.removeFlow(f1.getIdent())
             # update outgoing flow of t (it should go out from g2)
@@ -1164,12 +2347,12 @@ class BPMNGraph:
                 for f in incf:
                     source=f.getSource()
                     #ident, name, time, res):
-                    tnodeCOPY=Activity(tnode.getIdent()+"_"+str(counter), tnode.getName(), tnode.getTime(), tnode.getRes())
+                    tnodeCOPY=Activity(tnode.getIdent()+"_"+str(counter), tnode.getName(), tnode.getDuration(), tnode.getRes())
                     newp.addNode(tnodeCOPY)
                     counter=counter+1
 
                     # the preceding task has not shared resources
-                    if (len(tnode.getRes().intersection(source.getRes()))==0):
+                    if not(tnode.getResMask() & source.getResMask()):
                         # we move tnode in parallel with source
 
                         # we add two gateways and connect them to source and tnode
@@ -1191,7 +2374,7 @@ class BPMNGraph:
                         counter=counter+1
                         # update incoming flow of source (it should go to g1)
                         f1=list(currentp.getIncomingFlows(source.getIdent()))[0]  ## currentp and not newp (but why?)
-                        newp.addFlow(Flow("fref"+str(counter), f1.getSource(), g1))
+                        newp.addFlow(Flow("fref"+str(counter), f1.getSource(), g1, prob=f1.getProb()))
                         counter=counter+1
                         newp.removeFlow(f1.getIdent())
                         # update outgoing flow of source (it should go out from g2)
@@ -1269,7 +2452,7 @@ class BPMNGraph:
 
                         source2=newf.getSource()
                         # print("III", source2.getIdent(), newf.getIdent())
-                        newp.addFlow(Flow("fref"+str(counter), source2, g2))
+                        newp.addFlow(Flow("fref"+str(counter), source2, g2, prob=newf.getProb()))
                         counter=counter+1
                         newp.removeFlow(newf.getIdent())
 
@@ -1370,7 +2553,7 @@ class BPMNGraph:
                 counter=counter+1
                 # update incoming flow of pred (it should go to g1)
                 f1=list(currentp.getIncomingFlows(predtask.getIdent()))[0]  # DIFFERENT !
-                newp.addFlow(Flow("fref"+str(counter), f1.getSource(), g1))
+                newp.addFlow(Flow("fref"+str(counter), f1.getSource(), g1, prob=f1.getProb()))
                 counter=counter+1
                 newp.removeFlow(f1.getIdent())
                 # update outgoing flow of mergenode (it should go out from g2)
@@ -1460,7 +2643,7 @@ class BPMNGraph:
 
         if (pred.getClass()=="Activity"):
             # we put these 2 tasks in // only if no shared resources
-            if (len(tnode.getRes().intersection(pred.getRes()))==0):
+            if not(tnode.getResMask() & pred.getResMask()):
                 refactoringdone=True
                 tpattern="SEQ"
                 if verbose:
@@ -1488,7 +2671,7 @@ class BPMNGraph:
                 counter=counter+1
                 # update incoming flow of pred (it should go to g1)
                 f1=list(currentp.getIncomingFlows(pred.getIdent()))[0]
-                newp.addFlow(Flow("fref"+str(counter), f1.getSource(), g1))
+                newp.addFlow(Flow("fref"+str(counter), f1.getSource(), g1, prob=f1.getProb()))
                 counter=counter+1
                 newp.removeFlow(f1.getIdent())
                 # update outgoing flow of t (it should go out from g2)
@@ -1552,7 +2735,7 @@ class BPMNGraph:
 
                             removetnode=True
 
-                            tnodeCOPY=Activity(tnode.getIdent()+"_"+str(counter), tnode.getName(), tnode.getTime(), tnode.getRes())
+                            tnodeCOPY=Activity(tnode.getIdent()+"_"+str(counter), tnode.getName(), tnode.getDuration(), tnode.getRes())
                             newp.addNode(tnodeCOPY)
                             counter=counter+1
 
@@ -1560,7 +2743,7 @@ class BPMNGraph:
                             tpattern="MERGE" # possibly several ones....
 
                             # the preceding task has not shared resources
-                            if (len(tnode.getRes().intersection(source.getRes()))==0):
+                            if not(tnode.getResMask() & source.getResMask()):
                                 # we move tnode in parallel with source
 
                                 # we add two gateways and connect them to source and tnode
@@ -1582,7 +2765,7 @@ class BPMNGraph:
                                 counter=counter+1
                                 # update incoming flow of source (it should go to g1)
                                 f1=list(currentp.getIncomingFlows(source.getIdent()))[0]  ## currentp and not newp (but why?)
-                                newp.addFlow(Flow("fref"+str(counter), f1.getSource(), g1))
+                                newp.addFlow(Flow("fref"+str(counter), f1.getSource(), g1, prob=f1.getProb()))
                                 counter=counter+1
                                 newp.removeFlow(f1.getIdent())
                                 # update outgoing flow of source (it should go out from g2)
@@ -1614,7 +2797,7 @@ class BPMNGraph:
                         if verbose:
                             print("No shared resources.")
 
-                        tnodeCOPY=Activity(tnode.getIdent()+"_"+str(counter), tnode.getName(), tnode.getTime(), tnode.getRes())
+                        tnodeCOPY=Activity(tnode.getIdent()+"_"+str(counter), tnode.getName(), tnode.getDuration(), tnode.getRes())
                         newp.addNode(tnodeCOPY)
                         counter=counter+1
 
@@ -1659,7 +2842,7 @@ class BPMNGraph:
 
                                 source2=newf.getSource()
                                 # print("III", source2.getIdent(), newf.getIdent())
-                                newp.addFlow(Flow("fref"+str(counter), source2, g2))
+                                newp.addFlow(Flow("fref"+str(counter), source2, g2, prob=newf.getProb()))
                                 counter=counter+1
                                 newp.removeFlow(newf.getIdent())
 
@@ -1670,7 +2853,7 @@ class BPMNGraph:
                             print("Shared resources.")
 
                         # compute the list of tasks with shared resources
-                        tnodeCOPY=Activity(tnode.getIdent()+"_"+str(counter), tnode.getName(), tnode.getTime(), tnode.getRes())
+                        tnodeCOPY=Activity(tnode.getIdent()+"_"+str(counter), tnode.getName(), tnode.getDuration(), tnode.getRes())
                         ltasks=self.computeTasksWithSharedResources(currentp, onemerge, tnodeCOPY)
                         incf=newp.getIncomingFlowsActivityOnly(onemerge.getIdent())
 
@@ -1725,7 +2908,7 @@ class BPMNGraph:
 
                             removetnode=True
 
-                            tnodeCOPY=Activity(tnode.getIdent()+"_"+str(counter), tnode.getName(), tnode.getTime(), tnode.getRes())
+                            tnodeCOPY=Activity(tnode.getIdent()+"_"+str(counter), tnode.getName(), tnode.getDuration(), tnode.getRes())
                             newp.addNode(tnodeCOPY)
                             counter=counter+1
 
@@ -1809,7 +2992,7 @@ class BPMNGraph:
                     mergenode=newp.getMergeNode(pred)
                     # print("MERGE NODE", mergenode.getIdent())
                     # if a merge node was found, it means this part of the wf is balanced
-                    if (mergenode.getClass()=="Join"):
+                    if (mergenode!=None) and (mergenode.getClass()=="Join"):
 
                         # check resources that resources between the prev. task and the choice are different
                         #if (True):
@@ -1844,7 +3027,7 @@ class BPMNGraph:
                             counter=counter+1
                             # update incoming flow of pred (it should go to g1)
                             f1=list(currentp.getIncomingFlows(predtask.getIdent()))[0]
-                            newp.addFlow(Flow("fref"+str(counter), f1.getSource(), g1))
+                            newp.addFlow(Flow("fref"+str(counter), f1.getSource(), g1, prob=f1.getProb()))
                             counter=counter+1
                             newp.removeFlow(f1.getIdent())
                             # update outgoing flow of mergenode (it should go out from g2)
@@ -1924,14 +3107,28 @@ class BPMNGraph:
     # counts the number of flows between two nodes
     def countFlowsBetweenTwoNodes(self, proc, node1, node2):
         nb=0
-        flows=proc.getFlows()
-        for f in flows:
-            if (f.getSource().getIdent()==node1.getIdent()) and (f.getTarget().getIdent()==node2.getIdent()):
+        for f in proc.outDIC.get(node1.getIdent(), ()):
+            if (f.getTarget().getIdent()==node2.getIdent()):
                 nb=nb+1
         return nb
 
     # returns a Boolean indicating whether a node is reachable from another node
+    # checks whether target can be reached from source (following at least one flow)
+    # (iterative depth-first search, see getReachability to check many couples of nodes of the same process)
     def isNodeReachable(self, source, target):
+        visited=set()
+        tovisit=self.getSucc(source)
+        while (tovisit!=[]):
+            current=tovisit.pop()
+            if (current.getIdent()==target.getIdent()):
+                return True
+            if not(current.getIdent() in visited):
+                visited.add(current.getIdent())
+                tovisit.extend(self.getSucc(current))
+        return False
+
+    # previous (recursive) version of isNodeReachable
+    def isNodeReachableRec(self, source, target):
         return self.isNodeReachableAUX(source, target, [])
 
     def isNodeReachableAUX(self, current, target, visited):
@@ -1950,11 +3147,12 @@ class BPMNGraph:
 
     # simplifies a process by removing unnecessary nodes
     def simplify(self, proc):
-        newp=copy.deepcopy(proc)
+        newp=proc.copy()
         # newp.print()
 
         # we remove multiple flows between gateways
-        flows=newp.getFlows()
+        # (we iterate over a copy because flows are removed on the fly)
+        flows=list(newp.getFlows())
         for f in flows:
             source=f.getSource()
             target=f.getTarget()
@@ -1962,17 +3160,31 @@ class BPMNGraph:
             outf=newp.getOutgoingFlows(source.getIdent())
             # we check if there are several flows between two gateways
             if (source.isGateway()) and (target.isGateway()) and (nb>1): # (len(outf)>1):
-                newp.removeFlow(f.getIdent())
+                # the probability of the flow (out of an exclusive split) is given to another flow between the two gateways
+                outf=list(outf)
+                if (source.getType()=="exclusive") and (len([f2 for f2 in outf if (f2.getProb()!=None)])>0):
+                    probs=branchProbabilities(outf)
+                    newprobs={}
+                    for i in range(len(outf)):
+                        newprobs[outf[i].getIdent()]=probs[i]
+                    other=[f2 for f2 in outf if (f2.getTarget()==target) and (f2.getIdent()!=f.getIdent())][0]
+                    newprobs[other.getIdent()]=newprobs[other.getIdent()]+newprobs.pop(f.getIdent())
+                    newp.removeFlow(f.getIdent())
+                    newp.setBranchProbabilities(source.getIdent(), newprobs)
+                else:
+                    newp.removeFlow(f.getIdent())
             # we check if there is another path between two gateways (A VERIFIER SUR EXAMPLES)
             # this makes sense only for parallel gateways
-            ptmp=copy.deepcopy(newp)
-            ptmp.removeFlow(f.getIdent())
-            if (ptmp.isNodeReachable(source, target)) and (source.isGateway()) and (target.isGateway()):
+            # (the flow is removed for the check, and put back if there is no other path)
+            if (source.isGateway()) and (target.isGateway()):
                 if (source.getType()=="parallel") and (target.getType()=="parallel"):
+                    removed=newp.getFlow(f.getIdent())
                     newp.removeFlow(f.getIdent())
+                    if not(newp.isNodeReachable(source, target)) and (removed!=None):
+                        newp.addFlow(removed)
 
         # we remove gateway with one incoming and one outgoing flow
-        nodes=newp.getNodes()
+        nodes=list(newp.getNodes())
         for n in nodes:
             incf=newp.getIncomingFlows(n.getIdent())
             outf=newp.getOutgoingFlows(n.getIdent())
@@ -1986,7 +3198,7 @@ class BPMNGraph:
                 newp.removeFlow(incflow.getIdent())
                 newp.removeFlow(outflow.getIdent())
                 newp.removeNode(n.getIdent())
-                newp.addFlow(Flow(name, source, target))
+                newp.addFlow(Flow(name, source, target, prob=incflow.getProb()))
 
         return newp
 
@@ -2011,7 +3223,7 @@ class BPMNGraph:
             outf2=proc2.getOutgoingFlows(n2)
             res=(n1.getType()==n2.getType()) and (len(incf1)==len(incf2)) and (len(outf1)==len(outf2))
         elif (n1.getClass()=="Activity"):
-            res=(n1.getName()==n2.getName()) and (n1.getTime()==n2.getTime()) and (n1.getRes()==n2.getRes())
+            res=(n1.getName()==n2.getName()) and (n1.getDuration()==n2.getDuration()) and (n1.getRes()==n2.getRes())
 
         return res
 
@@ -2095,7 +3307,7 @@ class BPMNGraph:
             res=(n1.getType()==n2.getType()) and (len(incf1)==len(incf2)) and (len(outf1)==len(outf2)) and samesucc
         elif (n1.getClass()=="Activity"):
             samesucc=self.matchSucc(n1, n2, proc1, proc2)
-            res=(n1.getName()==n2.getName()) and (n1.getTime()==n2.getTime()) and (n1.getRes()==n2.getRes()) and samesucc
+            res=(n1.getName()==n2.getName()) and (n1.getDuration()==n2.getDuration()) and (n1.getRes()==n2.getRes()) and samesucc
         else:
             return self.matchSucc(n1, n2, proc1, proc2)
 
@@ -2130,13 +3342,6 @@ class BPMNGraph:
                 res=True
         return res
 
-    # checks if a process/workflow is in a dictionary of processes
-    def procInProcessesDIC(self, hash, proc, processes):
-        if not(hash in processes.keys()):
-            return False
-        else:
-            return self.procInProcesses(proc, processes[hash])
-
     # counts the nb of occurrences of a process in a list of proc
     def countAppearances(self, proc, processes):
         res=0
@@ -2145,36 +3350,63 @@ class BPMNGraph:
                 res=res+1
         return res
 
-    # computes a hash value for a process
-    def computeHashValue(self, proc):
-        nodes=proc.getNodes()
-        sumdist=0
-        dict = {}
-        for n in nodes:
-            dist=self.distanceFromStartNode(n, proc)
-            if dist in dict.keys():
-                dict[dist]=dict[dist]+1
+    # computes a canonical label for each node of a process (dictionary ident -> label)
+    # identifiers are ignored: a label only depends on the class of the node, on the
+    #  type of a gateway, on the name/time/resources of a task, and on the labels of
+    #  the neighbours of the node, which are refined iteratively (Weisfeiler-Lehman
+    #  refinement) until the partition of nodes is stable
+    # the probabilities of the outgoing flows of exclusive splits (see branchProbabilities) are part
+    #  of the labels, unless all the flows of the split have the same probability
+    # as in compareWorkflows, the property (weak/strong) of flows is not taken into account
+    def computeNodeLabels(self, proc):
+        labels={}
+        for n in proc.getNodes():
+            if (n.getClass()=="Activity"):
+                init=(n.getClass(), n.getName(), n.getDuration(), tuple(sorted(n.getRes())))
+            elif n.isGateway():
+                init=(n.getClass(), n.getType())
             else:
-                dict[dist]=1
-            # sumdist=sumdist+self.distanceFromStartNode(n, proc)
-        #val = sumdist+11*len(proc.getNodes())+17*len(proc.getFlows())+37*(len(proc.getExclusiveGateways())+1)+23*(len(proc.getParallelGateways())+1)+29*(len(proc.getSplits())+1)+31*(len(proc.getJoins())+1)+7*(proc.getSumTimeTasks()+1)
-        r=""
-        for k in sorted(dict.keys()):
-            #print(k,"->",dict[k])
-            r=r+str(dict[k])
-        return int(r) # + val
+                init=(n.getClass(),)
+            labels[n.getIdent()]=hashlib.sha1(repr(init).encode()).hexdigest()
+        nbclasses=len(set(labels.values()))
+        for i in range(len(labels)):
+            newlabels={}
+            for ident in labels:
+                outf=list(proc.getOutgoingFlows(ident))
+                probs=None
+                if (proc.getNode(ident).getClass()=="Split") and (proc.getNode(ident).getType()=="exclusive"):
+                    probs=branchProbabilities(outf)
+                    if (max(probs)-min(probs)<1e-12):
+                        probs=None
+                if (probs==None):
+                    succ=sorted([labels[f.getTarget().getIdent()] for f in outf])
+                else:
+                    # successors of an exclusive split with different probabilities are labelled with them
+                    succ=sorted([(round(probs[k], 12), labels[outf[k].getTarget().getIdent()]) for k in range(len(outf))])
+                pred=sorted([labels[f.getSource().getIdent()] for f in proc.getIncomingFlows(ident)])
+                newlabels[ident]=hashlib.sha1(repr((labels[ident], succ, pred)).encode()).hexdigest()
+            labels=newlabels
+            # the refinement can only split classes of nodes, we stop when no class is split anymore
+            newnbclasses=len(set(labels.values()))
+            if (newnbclasses==nbclasses):
+                break
+            nbclasses=newnbclasses
+        return labels
+
+    # computes a canonical fingerprint of a process (hexadecimal string)
+    # two processes which are the same up to identifiers have the same fingerprint
+    #  (see computeNodeLabels)
+    # the labels of the nodes can be given if they have already been computed
+    def computeFingerprint(self, proc, labels=None):
+        if (labels==None):
+            labels=self.computeNodeLabels(proc)
+        return hashlib.sha1(repr((sorted(labels.values()), len(proc.getFlows()))).encode()).hexdigest()
 
     # checks if a process/workflow is in a list of processes
-    # this 2nd version relies on hash codes and a dictionary storing all (existing) processes
+    # this 2nd version relies on fingerprints and a dictionary (or set) storing all (existing) processes
+    #  indexed by their fingerprint
     def procInProcessesV2(self, proc, processes):
-        res=False
-        newhash=self.computeHashValue(proc)
-        if newhask in processes.keys():
-            # TODO: check if proc is equal to one of the processes stored at that key
-            pass
-        return res
-    # NOTE: This solution has not been completed because the generation of hash value
-    #  corresponding to a process is not satisfactory (too many collisions)
+        return self.computeFingerprint(proc) in processes
 
     # simulation of the process given a precise strategy (one arbitrary succession of refactoring steps ONLY)
     # takes as input the list of resources and available amout (same for all resources now)
@@ -2185,8 +3417,8 @@ class BPMNGraph:
     # the nbsteps parameter allows to apply a given number of refactoring steps
     def simulateANDanalyseANDrefactor(self, nbreplicas, verbose, snumber, nbsteps):
 
-        currentp=copy.deepcopy(self)
-        newp=copy.deepcopy(self)
+        currentp=self.copy()
+        newp=self.copy()
 
         loopagain=True
 
@@ -2221,7 +3453,7 @@ class BPMNGraph:
                 # BASIC STRATEGY -> take the first one in the set of tasks !
                 # CAUTION: this strategy leads to infinite loops by applying infinitely patterns for sequence and splits !!
                 # OTHER STRATEGY -> take one task randomly
-                newp=copy.deepcopy(currentp)
+                newp=currentp.copy()
 
                 # old version to choose a task randomly
                 # index=random.randint(0,len(tasks)-1)
@@ -2242,9 +3474,10 @@ class BPMNGraph:
             else:
                 loopagain=False
 
-            currentp=copy.deepcopy(newp)
+            # newp is not modified anymore, it can be shared
+            currentp=newp
 
-            proclog.append(copy.deepcopy(newp))
+            proclog.append(newp)
 
         if (ind==0):
             print("Warning: the program stops because of infinite loop of refactorings.")
@@ -2318,40 +3551,436 @@ class BPMNGraph:
                 #print(t.getIdent(), "-> no succesors")
         return res
 
+    # checks whether the dependencies (couples of task idents, see computeDependProc) are preserved in
+    #  proc: the second task (or its copy) can still be reached from the first one
+    # (the reachability index of proc is computed once, each dependency is then a bit test)
     def preserveDependencies(self, proc, depend):
         res=True
+        number, reach = proc.getReachability()
+        nodeof={}   # task ident -> number of the node found by getNodePrefix
         for c in depend:
-            t1=c[0]
-            t2=c[1]
+            for t in c:
+                if not(t in nodeof):
+                    nodeof[t]=number[proc.getNodePrefix(t).getIdent()]
             # print (t1, proc.getNodePrefix(t1).getIdent())
             # print (t2, proc.getNodePrefix(t2).getIdent())
-            if not(proc.isNodeReachable(proc.getNodePrefix(t1), proc.getNodePrefix(t2))):
+            if not((reach[nodeof[c[0]]] >> nodeof[c[1]]) & 1):
                 res=False
+                break
         return res
 
+    # computes the transitive closure of the flows of the process, as bitsets: nodes are numbered,
+    #  and the nodes reachable from node number i (following at least one flow) are the bits set in
+    #  integer i (isNodeReachable is then a bit test)
+    # the strongly connected components (loops) are computed with Tarjan's algorithm, which gives them
+    #  in reverse topological order, so that the nodes reachable from a component are known when
+    #  it is found
+    # returns a couple (dictionary node ident -> number, list of bitsets)
+    def computeReachability(self):
+        nodes=list(self.getNodes())
+        number={}
+        for i in range(len(nodes)):
+            number[nodes[i].getIdent()]=i
+        succ=[[number[f.getTarget().getIdent()] for f in self.getOutgoingFlows(n.getIdent())] for n in nodes]
+        reach=[0]*len(nodes)
+        index=[-1]*len(nodes)   # order of the nodes in the depth-first search
+        low=[0]*len(nodes)
+        onstack=[False]*len(nodes)
+        stack=[]
+        count=0
+        for root in range(len(nodes)):
+            if (index[root]>=0):
+                continue
+            # iterative depth-first search, with couples (node, position of the next successor)
+            dfs=[(root, 0)]
+            index[root]=count
+            low[root]=count
+            count=count+1
+            stack.append(root)
+            onstack[root]=True
+            while (dfs!=[]):
+                v, i = dfs[-1]
+                if (i<len(succ[v])):
+                    dfs[-1]=(v, i+1)
+                    w=succ[v][i]
+                    if (index[w]<0):
+                        index[w]=count
+                        low[w]=count
+                        count=count+1
+                        stack.append(w)
+                        onstack[w]=True
+                        dfs.append((w, 0))
+                    elif onstack[w]:
+                        low[v]=min(low[v], index[w])
+                else:
+                    dfs.pop()
+                    if (dfs!=[]):
+                        low[dfs[-1][0]]=min(low[dfs[-1][0]], low[v])
+                    if (low[v]==index[v]):
+                        # v is the root of a component, made of the nodes above it on the stack
+                        component=[]
+                        w=-1
+                        while (w!=v):
+                            w=stack.pop()
+                            onstack[w]=False
+                            component.append(w)
+                        bits=0
+                        members=0
+                        for w in component:
+                            members=members|(1<<w)
+                            for x in succ[w]:
+                                bits=bits|(1<<x)|reach[x]
+                        # the nodes of a loop reach each other (and themselves)
+                        if (len(component)>1):
+                            bits=bits|members
+                        for w in component:
+                            reach[w]=bits
+        return (number, reach)
+
+    # returns the reachability index of the process (see computeReachability), which is computed
+    #  the first time and kept until the process is modified
+    def getReachability(self):
+        if (self.reachability==None):
+            self.reachability=self.computeReachability()
+        return self.reachability
+
+    # computes the set of flows closing a loop (back edges of a depth-first search from the start node)
+    def computeBackFlows(self):
+        back=set()
+        visited=set()
+        onstack=set()
+        # iterative depth-first search, the stack contains couples (node, outgoing flows still to be visited)
+        start=self.getStartNode()
+        stack=[(start, list(self.getOutgoingFlows(start.getIdent())))]
+        visited.add(start.getIdent())
+        onstack.add(start.getIdent())
+        while (stack!=[]):
+            node, flows = stack[-1]
+            if (flows==[]):
+                stack.pop()
+                onstack.discard(node.getIdent())
+            else:
+                f=flows.pop()
+                target=f.getTarget()
+                if (target.getIdent() in onstack):
+                    back.add(f.getIdent())
+                elif not(target.getIdent() in visited):
+                    visited.add(target.getIdent())
+                    onstack.add(target.getIdent())
+                    stack.append((target, list(self.getOutgoingFlows(target.getIdent()))))
+        return back
+
+    # computes the length of the critical path of the process with unlimited resources
+    #  (longest time from the start node to the end of the process, following all branches
+    #   of parallel splits, loops are executed once)
+    # the exclusive parameter indicates how exclusive splits are handled
+    #  ("min" = shortest branch, which gives a lower bound of the execution time, "max" = longest branch,
+    #   "expected" = average of the branches weighted by their probabilities, see branchProbabilities,
+    #   branches with a zero probability being ignored in the three cases)
+    def computeCriticalPath(self, exclusive="min"):
+        back=self.computeBackFlows()
+        remaining={}
+        # the remaining time of a node is computed once all its successors are known
+        # (nodes are handled in reverse topological order, loops being cut by back flows)
+        order=[]
+        visited=set()
+        start=self.getStartNode()
+        stack=[(start, False)]
+        while (stack!=[]):
+            node, done = stack.pop()
+            if done:
+                order.append(node)
+            elif not(node.getIdent() in visited):
+                visited.add(node.getIdent())
+                stack.append((node, True))
+                for f in self.getOutgoingFlows(node.getIdent()):
+                    if not(f.getIdent() in back):
+                        stack.append((f.getTarget(), False))
+        for node in order:
+            succ=[]
+            probs=[]
+            flows=list(self.getOutgoingFlows(node.getIdent()))
+            if (node.kind is NodeKind.SPLIT) and (node.getType()=="exclusive"):
+                fprobs=branchProbabilities(flows)
+            else:
+                fprobs=[1]*len(flows)
+            for i in range(len(flows)):
+                if not(flows[i].getIdent() in back) and (fprobs[i]>0):
+                    succ.append(remaining[flows[i].getTarget().getIdent()])
+                    probs.append(fprobs[i])
+            if (succ==[]):
+                after=0
+            elif (node.kind is NodeKind.SPLIT) and (node.getType()=="exclusive") and (exclusive=="min"):
+                after=min(succ)
+            elif (node.kind is NodeKind.SPLIT) and (node.getType()=="exclusive") and (exclusive=="expected"):
+                after=sum(succ[i]*probs[i] for i in range(len(succ)))/sum(probs)
+            else:
+                after=max(succ)
+            if (node.kind is NodeKind.ACTIVITY):
+                after=after+node.getTime()
+            remaining[node.getIdent()]=after
+        return remaining[start.getIdent()]
+
+    # computes the exclusive split deciding whether a loop is iterated again, from the back flow
+    #  of the loop (see computeBackFlows): the split is found by going back from the back flow
+    #  through nodes with a single incoming flow (the tasks executed before going back)
+    # returns a tuple (split, outgoing flow of the split leading to the back flow, list of the
+    #  nodes between them), or None if there is no such split
+    def computeLoopSplit(self, backflow):
+        flow=self.getFlow(backflow)
+        node=flow.getSource()
+        repeat=[]
+        while not((node.kind is NodeKind.SPLIT) and (node.getType()=="exclusive")):
+            incf=self.getIncomingFlows(node.getIdent())
+            if (node.kind is not NodeKind.ACTIVITY) or (len(incf)!=1):
+                return None
+            repeat.append(node)
+            flow=list(incf)[0]
+            node=flow.getSource()
+        return (node, flow, repeat)
+
+    # computes the structured loops of the process: an exclusive merge (entry of the loop), an
+    #  exclusive split (exit of the loop, see computeLoopSplit) and a back flow to the merge
+    # returns a list of tuples (merge, split, set of idents of the nodes of the body, that is,
+    #  the nodes between the merge and the split, flow of the split leading back to the merge,
+    #  list of the tasks between this flow and the merge), the smallest bodies first (inner loops first)
+    def computeLoops(self):
+        back=self.computeBackFlows()
+        loops=[]
+        for ident in back:
+            merge=self.getFlow(ident).getTarget()
+            loopsplit=self.computeLoopSplit(ident)
+            if (loopsplit!=None) and (merge.kind is NodeKind.JOIN) and (merge.getType()=="exclusive"):
+                split, flow, repeat = loopsplit
+                # nodes reachable from the merge without going through the split
+                forward=set()
+                tovisit=[merge]
+                while (tovisit!=[]):
+                    n=tovisit.pop()
+                    if not(n.getIdent() in forward) and (n.getIdent()!=split.getIdent()):
+                        forward.add(n.getIdent())
+                        for f in self.getOutgoingFlows(n.getIdent()):
+                            if not(f.getIdent() in back):
+                                tovisit.append(f.getTarget())
+                # nodes from which the split is reachable without going through the merge
+                backward=set()
+                tovisit=[split]
+                while (tovisit!=[]):
+                    n=tovisit.pop()
+                    if not(n.getIdent() in backward) and (n.getIdent()!=merge.getIdent()):
+                        backward.add(n.getIdent())
+                        for f in self.getIncomingFlows(n.getIdent()):
+                            if not(f.getIdent() in back):
+                                tovisit.append(f.getSource())
+                body=(forward&backward)-set([merge.getIdent(), split.getIdent()])
+                loops.append((merge, split, body, flow, repeat))
+        return sorted(loops, key=lambda l: len(l[2])+len(l[4]))
+
+    # computes a version of the process without loops, in which each loop (see computeLoops) is
+    #  replaced by a task (macro task, with identifier "loop_" + identifier of the merge) whose
+    #  duration is the expected duration of the loop: with N the number of iterations, the body
+    #  is executed N times (length of its critical path, see computeCriticalPath, "expected" mode),
+    #  and the tasks before going back N-1 times, the expected value of N being computed from the
+    #  probability q of going back (see branchProbabilities): 1/(1-q), or (1-q^maxiterations)/(1-q)
+    #  if the number of iterations is bounded by maxiterations
+    # the macro task uses all the resources of the tasks of the loop (it is an approximation of the
+    #  loop, whose tasks do not use all their resources all the time)
+    # inner loops are replaced first, loops which are not structured or never end are kept
+    # returns a couple (process, dictionary macro task ident -> list of idents of the tasks of the loop)
+    def computeLoopFreeProcess(self, maxiterations=None):
+        newp=self.copy()
+        macros={}
+        done=set()      # loops which cannot be replaced
+        while True:
+            loops=[l for l in newp.computeLoops() if not((l[0].getIdent(), l[1].getIdent()) in done)]
+            if (loops==[]):
+                break
+            merge, split, body, repeatflow, repeat = loops[0]
+            outf=list(newp.getOutgoingFlows(split.getIdent()))
+            q=branchProbabilities(outf)[outf.index(repeatflow)]
+            if (maxiterations!=None):
+                if (q>=1):
+                    iterations=maxiterations
+                else:
+                    iterations=(1-q**maxiterations)/(1-q)
+            elif (q<1):
+                iterations=1/(1-q)
+            else:
+                print("Warning: the loop starting with", merge.getIdent(), "never ends, it is kept.")
+                done.add((merge.getIdent(), split.getIdent()))
+                continue
+
+            # critical path of the body, computed on a process made of the body only
+            start=Start("loopstart_"+merge.getIdent())
+            end=End("loopend_"+merge.getIdent())
+            bodynodes=set([start, end])
+            bodyflows=set()
+            res=set()
+            tasks=[]
+            for ident in body:
+                n=newp.getNode(ident)
+                bodynodes.add(n)
+                if (n.getClass()=="Activity"):
+                    res=res|set(n.getRes())
+                    tasks.extend(macros.get(ident, [ident]))
+            for f in newp.getOutgoingFlows(merge.getIdent()):
+                if (f.getTarget().getIdent()==split.getIdent()):
+                    bodyflows.add(Flow("loopflow_"+f.getIdent(), start, end))
+                else:
+                    bodyflows.add(Flow("loopflow_"+f.getIdent(), start, f.getTarget()))
+            for ident in body:
+                for f in newp.getOutgoingFlows(ident):
+                    if (f.getTarget().getIdent() in body):
+                        bodyflows.add(f)
+                    elif (f.getTarget().getIdent()==split.getIdent()):
+                        bodyflows.add(Flow("loopflow_"+f.getIdent(), f.getSource(), end))
+            bodyp=BPMNGraph("loop_"+merge.getIdent(), bodynodes, bodyflows)
+            duration=bodyp.computeCriticalPath("expected")*iterations
+            for n in repeat:
+                res=res|set(n.getRes())
+                tasks.extend(macros.get(n.getIdent(), [n.getIdent()]))
+                duration=duration+n.getTime()*(iterations-1)
+
+            # the loop is replaced by the macro task
+            macro=Activity("loop_"+merge.getIdent(), "loop_"+merge.getIdent(), duration, sorted(res))
+            newp.addNode(macro)
+            for f in list(newp.getIncomingFlows(merge.getIdent())):
+                newp.removeFlow(f.getIdent())
+                # the back flow comes from the split or from the last task before going back
+                if not(f.getSource() in repeat) and (f.getSource()!=split):
+                    newp.addFlow(Flow(f.getIdent(), f.getSource(), macro, f.getProp(), f.getProb()))
+            newp.removeFlow(repeatflow.getIdent())
+            for ident in body|set([merge.getIdent()])|set([n.getIdent() for n in repeat]):
+                for f in list(newp.getOutgoingFlows(ident)):
+                    newp.removeFlow(f.getIdent())
+                newp.removeNode(ident)
+                macros.pop(ident, None)
+            exits=list(newp.getOutgoingFlows(split.getIdent()))
+            if (len(exits)==1):
+                # the split is not needed anymore
+                newp.removeFlow(exits[0].getIdent())
+                newp.removeNode(split.getIdent())
+                newp.addFlow(Flow(exits[0].getIdent(), macro, exits[0].getTarget(), exits[0].getProp()))
+            else:
+                newp.addFlow(Flow("loopflow_"+split.getIdent(), macro, split))
+            macros[macro.getIdent()]=tasks
+        return (newp, macros)
+
+    # checks whether the end of the process cannot be reached from a node without going through node2
+    def isPostDominated(self, node, node2):
+        visited=set([node2.getIdent()])
+        stack=[node]
+        while (stack!=[]):
+            current=stack.pop()
+            if (current.getIdent() in visited):
+                continue
+            visited.add(current.getIdent())
+            if (current.getClass()=="End"):
+                return False
+            stack.extend(self.getSucc(current))
+        return True
+
+    # computes the set of tasks executed in every run of the process, whatever the exclusive choices are
+    # a node is executed if it follows an executed node which is not an exclusive split, or if
+    #  all paths from an executed exclusive split to the end go through it
+    def computeMandatoryTasks(self):
+        mandatory=set()
+        start=self.getStartNode()
+        reached=set([start.getIdent()])
+        tovisit=[start]
+        while (tovisit!=[]):
+            node=tovisit.pop()
+            if (node.getClass()=="Activity"):
+                mandatory.add(node)
+            if (node.getClass()=="Split") and (node.getType()=="exclusive"):
+                succ=[]
+                for n in self.getNodes():
+                    if not(n.getIdent() in reached) and (n.getIdent()!=node.getIdent()) and self.isPostDominated(node, n):
+                        succ.append(n)
+            else:
+                succ=self.getSucc(node)
+            for n in succ:
+                if not(n.getIdent() in reached):
+                    reached.add(n.getIdent())
+                    tovisit.append(n)
+        return mandatory
+
+    # computes a lower bound of the execution time of the process based on resources:
+    #  a resource cannot be used by more tasks at the same time than its number of replicas,
+    #  so the total time of the tasks executed in every run with that resource is a bound
+    # this bound does not change when tasks are moved by refactoring
+    def computeResourceBound(self, nbreplicas):
+        resources=self.computeResources(nbreplicas)
+        busy={}
+        for t in self.computeMandatoryTasks():
+            for r in t.getRes():
+                busy[r]=busy.get(r,0)+t.getTime()
+        res=0
+        for r in busy:
+            if (resources[r]>0):
+                res=max(res, busy[r]/resources[r])
+        return res
+
+    # computes a lower bound of the execution time of the process based on the (strong) causal
+    #  dependencies in depend: tasks of a chain of dependencies (executed in every run) are
+    #  necessarily executed one after the other
+    # this bound does not change when tasks are moved by refactoring (dependencies are preserved)
+    def computeDependencyBound(self, depend):
+        mandatory=set()
+        for t in self.computeMandatoryTasks():
+            mandatory.add(t.getIdent())
+        succ={}
+        for c in depend:
+            if (c[0] in mandatory) and (c[1] in mandatory):
+                succ.setdefault(c[0], []).append(c[1])
+        # longest chain starting from each task (a task already on the chain is not followed again)
+        memo={}
+        def longest(t, visited):
+            if (t in memo):
+                return memo[t]
+            res=0
+            for t2 in succ.get(t, []):
+                if not(t2 in visited):
+                    res=max(res, longest(t2, visited|{t2}))
+            res=res+self.getNode(t).getTime()
+            memo[t]=res
+            return res
+        res=0
+        for t in mandatory:
+            res=max(res, longest(t, {t}))
+        return res
+
+    # computes a lower bound of the average execution time of the process
+    # (critical path with unlimited resources, and time of the busiest resource)
+    def computeLowerBound(self, nbreplicas):
+        return max(self.computeCriticalPath("min"), self.computeResourceBound(nbreplicas))
+
     # this function computes the best refactoring (wrt. execution time as optimization criterion)
-    # inputs: - nb of replicas of each resource (currently works for one replica only, duplicate names if several replicas)
+    # inputs: - nb of replicas of each resource (same nb for all resources, or dictionary resource -> nb of replicas)
     #         - verbose if dumps text messages during simulation
     #         - snumber is the number of simulations
     #         - strategy indicates how to choose tasks to be moved
     #           ("exploration" = brute force approach with full exploration of all possibilities)
     #           ("heuristic" = keep to tasks to be applied first in terms of time)
-    #         - the final parameter (optional, default value=1000) corresponds to the max number of explored processes
+    #         - the bound parameter (optional, default value=1000) corresponds to the max number of explored processes
     #           (it is used to stop the exploration when there are too many processes)
     #           (if it stops, the best current one is returned)
-    def computeOptimalRefactoring(self, nbreplicas, verbose, snumber, strategy, bound=1000):
+    #         - the optional cache parameter (SimulationCache) avoids simulating several times the same process
+    #         - the optional engine parameter is the simulator used by simulateANDanalyse
+    #           (with "exact", processes are compared with their exact expected time, without noise)
+    def computeOptimalRefactoring(self, nbreplicas, verbose, snumber, strategy, bound=1000, cache=None, engine="tick"):
         tobeexplored=[]     # list of processes to be explored
         alreadyexplored=[]  # list of already explored processes
 
-        initialp=copy.deepcopy(self)
+        initialp=self.copy()
         tobeexplored.append(initialp)
 
         tmin=1000000 # beurk
         bestproc=None
 
         # we compute the time of the original process
-        proctmp=copy.deepcopy(self)
-        initlog=proctmp.simulateANDanalyse(nbreplicas, False, snumber)
+        proctmp=self.copy()
+        initlog=proctmp.simulateANDanalyse(nbreplicas, False, snumber, engine, cache=cache)
         inittime=initlog[1]
 
         # we compute the (strong) causal dependencies on the initial process
@@ -2359,29 +3988,22 @@ class BPMNGraph:
         # print(depend)
 
         ind=0
-        shash=set()
 
         while (len(tobeexplored)>0) and (ind<bound):
 
             print("Nb of explored processes =", len(alreadyexplored), "(original time =", inittime, "best time =", tmin,")")
             print("Nb of processes to be explored =", len(tobeexplored))
-            # print("Nb of hash values =", len(shash))
 
             ind=ind+1
 
             currentp=tobeexplored.pop(0)
-            alreadyexplored.append(copy.deepcopy(currentp))
+            alreadyexplored.append(currentp)
 
             # currentp.generate_bpmnxml(currentp.getName()+"_"+str(ind))
             # currentp.print()
 
-            # TEMPORARY EXPERIMENTS ON HASH FUNCTIONS
-            newhash=currentp.computeHashValue(currentp)
-            # print ("HASH =", newhash)
-            shash.add(newhash)
-
             # simulates
-            log=currentp.simulateANDanalyse(nbreplicas, False, snumber)
+            log=currentp.simulateANDanalyse(nbreplicas, False, snumber, engine, cache=cache)
 
             # print(log[0])
 
@@ -2411,15 +4033,15 @@ class BPMNGraph:
             #t=list(tasks)[0]
             for t in tasks:
                 #print("Moved task=",t)
-                newp=copy.deepcopy(currentp)
+                newp=currentp.copy()
                 p=self.refactor3(currentp, newp, t, False)
-                newp=self.simplify(copy.deepcopy(p[0]))
+                newp=self.simplify(p[0])
                 if (p[1]): # important !
                     # we check if the new process respects the strong dependencies defined in the initial process
                     if (self.preserveDependencies(newp, depend)):
                         # we check if the process is not in one of the two queues
                         if not(self.procInProcesses(newp, alreadyexplored)) and not(self.procInProcesses(newp, tobeexplored)):
-                            tobeexplored.append(copy.deepcopy(newp))
+                            tobeexplored.append(newp)
                             #print("PATTERN =",p[2])
 
         if (ind>=bound):
@@ -2428,114 +4050,1007 @@ class BPMNGraph:
         # print("New AET =", tmin, "( AET of the initial process =", inittime,")")
         # print("Nb of explored processes =", len(alreadyexplored))
 
-        # TEMPORARY EXPERIMENTS ON HASH FUNCTIONS
-        # print("Nb of explored processes =", len(alreadyexplored))
-        # print("Nb of hash values =", len(shash))
-
         return (bestproc, inittime, tmin, alreadyexplored)
 
 
-    # second version, using dictionaries for performance purposes
-    def computeOptimalRefactoringV2(self, nbreplicas, verbose, snumber, strategy, bound=1000):
-        tobeexplored=[]     # list of processes to be explored
+    # simulates one candidate process of the exploration and computes its refactorings
+    # returns a couple (log, list of new processes) where log is the result of
+    #  simulateANDanalyse, and the new processes are those obtained by refactoring
+    #  (and simplifying) the candidate which respect the strong dependencies in depend
+    # if log is given (result already known), the candidate is not simulated
+    # (ciwidth, engine and streams are the adaptive mode, the simulator and the random streams of simulateANDanalyse)
+    def expandCandidate(self, currentp, nbreplicas, snumber, strategy, depend, log=None, cache=None, ciwidth=None, engine="tick", streams=None):
+
+        # simulates
+        if (log==None):
+            log=currentp.simulateANDanalyse(nbreplicas, False, snumber, engine, cache=cache, ciwidth=ciwidth, streams=streams)
+
+        # computes from the log all tasks that can be executed earlier in the process
+        if (strategy=="exploration"):
+            tasks=set()
+            for entry in log[0]:
+                tasks.add(entry[1])
+        # (strategy=="heuristic")
+        # we keep only tasks that are waiting the less before being executed
+        # if there are several ones with the same time, we keep all of them
+        else:
+            tasks=self.computeSetTasks(log)
+            tasks2=list(tasks)
+            if (len(tasks2)!=0):
+                tasks=set()
+                tasks.add(tasks2[0])
+            else:
+                tasks=set()
+
+        newprocs=[]
+        for t in tasks:
+            newp=currentp.copy()
+            p=self.refactor3(currentp, newp, t, False)
+            newp=self.simplify(p[0])
+            if (p[1]):
+                # we check if the new process respects the strong dependencies defined in the initial process
+                if (self.preserveDependencies(newp, depend)):
+                    newprocs.append(newp)
+
+        return (log, newprocs)
+
+    # second version, using dictionaries (indexed by process fingerprints) for performance purposes
+    # the optional nbworkers parameter enables a parallel exploration: the whole frontier
+    #  of processes to be explored (in BFS order) is simulated and refactored by a pool of
+    #  nbworkers processes, the coordinator (this process) keeps the deduplication of new processes
+    # the optional cache parameter (SimulationCache) avoids simulating several times the same process
+    #  (in parallel mode, the cache is used by the coordinator only)
+    # the optional search parameter indicates the order of the exploration
+    #  ("bfs" = processes are explored in the order they are found,
+    #   "bestfirst" = the process with the smallest lower bound (computeLowerBound) is explored first,
+    #   and the exploration stops as soon as no refactoring can beat the best time found, that is,
+    #   when this time reaches the bounds based on resources and dependencies which hold for all refactorings)
+    # the optional ciwidth parameter enables the adaptive number of simulations of each process
+    #  (see simulateANDanalyse, snumber is then the max number of simulations)
+    # the optional engine parameter is the simulator used by simulateANDanalyse
+    #  (with "exact", processes are compared with their exact expected time, without noise)
+    # if the optional crn parameter is True, all the processes are simulated with the same random
+    #  choices for exclusive splits (common random numbers, see ChoiceStreams), so that they can be
+    #  compared with fewer simulations
+    def computeOptimalRefactoringV2(self, nbreplicas, verbose, snumber, strategy, bound=1000, nbworkers=1, cache=None, search="bfs", ciwidth=None, engine="tick", crn=False):
+
+        global counter
+
+        tobeexplored=[]     # list of processes to be explored (a heap of (lower bound, order, process) for "bestfirst")
         tobeexploredDIC={}  # dictionary of processes to be explored
         alreadyexplored={}  # dictionary of already explored processes
 
-        initialp=copy.deepcopy(self)
-        tobeexplored.append(initialp)
-        tobeexploredDIC[initialp.computeHashValue(initialp)]=[initialp]
+        initialp=self.copy()
+        if (search=="bestfirst"):
+            tobeexplored.append((initialp.computeLowerBound(nbreplicas), 0, initialp))
+        else:
+            tobeexplored.append(initialp)
+        tobeexploredDIC[initialp.computeFingerprint(initialp)]=[initialp]
+        order=1
 
         tmin=1000000 # beurk
         bestproc=None
 
+        streams=None
+        if crn:
+            streams=ChoiceStreams(random.randrange(2**32))
+
         # we compute the time of the original process
-        proctmp=copy.deepcopy(self)
-        initlog=proctmp.simulateANDanalyse(nbreplicas, False, snumber)
+        proctmp=self.copy()
+        initlog=proctmp.simulateANDanalyse(nbreplicas, False, snumber, engine, cache=cache, ciwidth=ciwidth, streams=streams)
         inittime=initlog[1]
 
         # we compute the (strong) causal dependencies on the initial process
         depend=self.computeDependProc(initialp)
         # print(depend)
 
+        # no refactoring can be faster than this bound
+        if (search=="bestfirst"):
+            globalbound=max(initialp.computeResourceBound(nbreplicas), initialp.computeDependencyBound(depend))
+
         ind=0
         shash=set()
 
-        while (len(tobeexplored)>0) and (ind<bound):
+        # the workers of the pool are stopped when leaving the with block (also if a worker raises an exception)
+        if (nbworkers>1):
+            pool=multiprocessing.Pool(nbworkers, initExplorationWorker, (self, nbreplicas, snumber, strategy, depend, ciwidth, engine, streams))
+        else:
+            pool=contextlib.nullcontext()
+
+        with pool:
+            while (len(tobeexplored)>0) and (ind<bound):
+
+                if (search=="bestfirst") and (tmin<=globalbound):
+                    print("The best time found cannot be improved (lower bound =", globalbound,").")
+                    break
+
+                print("Nb of explored processes =", ind, "(original time =", inittime, "best time =", tmin,")")
+                print("Nb of processes to be explored =", len(tobeexplored))
+                print("Nb of hash values =", len(shash))
+
+                # the processes explored in this iteration (the whole frontier in parallel mode,
+                #  the nbworkers processes with the smallest lower bounds for "bestfirst")
+                if (search=="bestfirst"):
+                    frontier=[]
+                    while (len(tobeexplored)>0) and (len(frontier)<min(nbworkers, bound-ind)):
+                        frontier.append(heapq.heappop(tobeexplored)[2])
+                elif (nbworkers>1):
+                    frontier=tobeexplored[:bound-ind]
+                    tobeexplored=tobeexplored[bound-ind:]
+                else:
+                    frontier=[tobeexplored.pop(0)]
+                ind=ind+len(frontier)
+
+                for currentp in frontier:
+                    # currentp.generate_bpmnxml(currentp.getName()+"_"+str(ind))
+                    # processes are indexed by their fingerprint, which is unique in tobeexplored
+                    newhash=currentp.computeFingerprint(currentp)
+                    shash.add(newhash)
+                    alreadyexplored[newhash]=[currentp]
+
+                if (nbworkers>1):
+                    # each job gets its own range of fresh identifiers, its own seed,
+                    #  and the result of the simulation if it is already in the cache
+                    jobs=[]
+                    centries=[]
+                    # (with streams, the batch engine is replaced by the compiled one, see simulateANDanalyse)
+                    cengine="compiled" if (streams!=None) and (engine=="batch") else engine
+                    for i in range(len(frontier)):
+                        cres=None
+                        if (cache!=None):
+                            if (engine=="exact"):
+                                centries.append(cache.prepare(frontier[i], nbreplicas, "exact", None, engine))
+                            elif (streams!=None):
+                                centries.append(cache.prepare(frontier[i], nbreplicas, snumber, ("streams", streams.seed), cengine, ciwidth))
+                            else:
+                                centries.append(cache.prepare(frontier[i], nbreplicas, snumber, None, cengine, ciwidth))
+                            cres=cache.get(centries[i])
+                        jobs.append((frontier[i], counter+i*COUNTERSTRIDE, random.randrange(2**32), cres))
+                    results=pool.map(exploreCandidate, jobs)
+                    for i in range(len(results)):
+                        counter=max(counter, results[i][2])
+                        if (cache!=None) and (jobs[i][3]==None):
+                            cache.put(centries[i], results[i][0])
+                else:
+                    results=[self.expandCandidate(frontier[0], nbreplicas, snumber, strategy, depend, cache=cache, ciwidth=ciwidth, engine=engine, streams=streams)]
 
-            isbest=False
+                for i in range(len(frontier)):
+                    currentp=frontier[i]
+                    log=results[i][0]
 
-            print("Nb of explored processes =", ind, "(original time =", inittime, "best time =", tmin,")")
-            print("Nb of processes to be explored =", len(tobeexplored))
-            print("Nb of hash values =", len(shash))
+                    if (log[1]<tmin):
+                        tmin=log[1]
+                        bestproc=currentp
 
-            ind=ind+1
+                    for newp in results[i][1]:
+                        # we check if the process is not in one of the two queues (same fingerprint)
+                        newhash=newp.computeFingerprint(newp)
+                        if not(newhash in alreadyexplored) and not(newhash in tobeexploredDIC):
 
-            currentp=tobeexplored.pop(0)
+                            #if isbest:
+                                # we put at the beginning of the queue / list
+                            #    tobeexplored.insert(0,copy.deepcopy(newp))
+                            #else:
+                            if (search=="bestfirst"):
+                                heapq.heappush(tobeexplored, (newp.computeLowerBound(nbreplicas), order, newp))
+                                order=order+1
+                            else:
+                                tobeexplored.append(newp)
 
-            # currentp.generate_bpmnxml(currentp.getName()+"_"+str(ind))
+                            tobeexploredDIC[newhash]=[newp]
 
-            newhash=currentp.computeHashValue(currentp)
-            shash.add(newhash)
-            if (newhash in alreadyexplored.keys()):
-                alreadyexplored[newhash].append(copy.deepcopy(currentp))
+        if (ind>=bound):
+            print("Warning: exploration was stopped because max bound was reached.")
+
+        return (bestproc, inittime, tmin, alreadyexplored)
+
+
+
+
+##
+# Choices of the outgoing flows of exclusive splits for one execution of the exact analysis
+# (see computeExactAnalysis): the first choices are given by a prefix (list of flow indexes),
+# then the first flow with a non-zero probability is always chosen. The choices made and the
+# probabilities of the flows of each split are kept, so that the other executions can be enumerated.
+class PathChooser:
+
+    def __init__(self, prefix):
+        self.prefix=prefix
+        self.taken=[]       # indexes of the chosen flows
+        self.arities=[]     # number of outgoing flows of each split
+        self.probs=[]       # probabilities of the outgoing flows of each split (see branchProbabilities)
+
+    # chooses the outgoing flow of a split, returns its index in flows
+    def choose(self, split, flows):
+        k=len(self.taken)
+        probs=branchProbabilities(flows)
+        if (k<len(self.prefix)):
+            index=self.prefix[k]
+        else:
+            index=0
+            while (probs[index]<=0) and (index<len(flows)-1):
+                index=index+1
+        self.taken.append(index)
+        self.arities.append(len(flows))
+        self.probs.append(probs)
+        return index
+
+    # returns the probability of the choices made after the prefix, until choice k (excluded)
+    def getProbability(self, k):
+        prob=1.0
+        for i in range(len(self.prefix), k):
+            prob=prob*self.probs[i][self.taken[i]]
+        return prob
+
+    # returns the probability of flow i at choice k
+    def getBranchProbability(self, k, i):
+        return self.probs[k][i]
+
+
+##
+# Random streams used for the choices of exclusive splits (common random numbers): stream
+# (rep, split) is the sequence of numbers used by simulation number rep each time the split
+# is reached. Numbers are drawn the first time they are needed (from a generator seeded with
+# seed, rep and the split identifier), and kept, so that all the processes simulated with the
+# same streams get the same numbers (refactorings keep the identifiers of exclusive splits).
+class ChoiceStreams:
+
+    def __init__(self, seed):
+        self.seed=seed
+        self.streams={}     # (rep, split ident) -> (generator, numbers drawn so far)
+
+    # returns the k-th number (in [0,1)) of stream (rep, split)
+    def getUniform(self, rep, split, k):
+        stream=self.streams.get((rep, split))
+        if (stream==None):
+            stream=(random.Random(str(self.seed)+":"+str(rep)+":"+split), [])
+            self.streams[(rep, split)]=stream
+        while (len(stream[1])<=k):
+            stream[1].append(stream[0].random())
+        return stream[1][k]
+
+##
+# Choices of the outgoing flows of exclusive splits for simulation number rep, using the
+# streams of a ChoiceStreams object: the k-th time a split is reached, the k-th number u of its
+# stream selects the flow of rank int(u*nb of flows) in the order given by computeBranchOrder
+# (or, if flows have different probabilities, the first flow in this order such that u is lower
+# than the sum of the probabilities of the flows up to it).
+class StreamChooser:
+
+    def __init__(self, streams, rep, branchorder):
+        self.streams=streams
+        self.rep=rep
+        self.branchorder=branchorder
+        self.visits={}      # split ident -> number of times the split was reached
+
+    # chooses the outgoing flow of a split, returns its index in flows
+    def choose(self, split, flows):
+        k=self.visits.get(split.getIdent(), 0)
+        self.visits[split.getIdent()]=k+1
+        u=self.streams.getUniform(self.rep, split.getIdent(), k)
+        ranks=self.branchorder[split.getIdent()]
+        ordered=sorted(range(len(flows)), key=lambda i: ranks[flows[i].getIdent()])
+        probs=branchProbabilities(flows)
+        if (max(probs)-min(probs)<1e-12):
+            return ordered[int(u*len(flows))]
+        cumulated=0
+        for i in ordered:
+            cumulated=cumulated+probs[i]
+            if (u<cumulated):
+                return i
+        return ordered[len(ordered)-1]
+
+##
+# Choices of the outgoing flows of exclusive splits which bound the number of iterations of
+# loops: loopflows gives the outgoing flows of exclusive splits leading back to the start of a
+# loop (dictionary split ident -> set of flow idents, see computeLoopSplit). When a loop has been iterated maxiterations times, one
+# of the other flows is taken (according to their probabilities), the count of the loop then
+# starts again. The other choices are made by chooser (if any), or randomly.
+# The alias tables of the choices (see buildAliasTable) are built once per split of proc.
+class LoopChooser:
+
+    def __init__(self, proc, loopflows, maxiterations, chooser=None):
+        self.loopflows=loopflows
+        self.maxiterations=maxiterations
+        self.chooser=chooser
+        self.iterations={}  # split ident -> number of iterations of the loop so far
+        # split ident -> couple (flows, alias table), for all the outgoing flows (see getBranchTable),
+        #  and for the flows leaving the loop
+        self.tables={}
+        self.exits={}
+        for n in proc.getSplits():
+            if (n.getType()=="exclusive"):
+                self.tables[n.getIdent()]=proc.getBranchTable(n)
+                back=loopflows.get(n.getIdent())
+                if (back!=None):
+                    exits=[f for f in self.tables[n.getIdent()][0] if not(f.getIdent() in back)]
+                    self.exits[n.getIdent()]=(exits, buildAliasTable(branchProbabilities(exits)))
+
+    # draws a flow with a couple (flows, alias table), returns its index in flows (the flows
+    #  given to choose, which are not necessarily in the same order)
+    def sample(self, table, flows):
+        ident=table[0][sampleBranch(table[1], len(table[0]), random)].getIdent()
+        for i in range(len(flows)):
+            if (flows[i].getIdent()==ident):
+                return i
+
+    # chooses the outgoing flow of a split, returns its index in flows
+    def choose(self, split, flows):
+        back=self.loopflows.get(split.getIdent())
+        if (back!=None):
+            k=self.iterations.get(split.getIdent(), 0)+1
+            if (k>=self.maxiterations):
+                index=self.sample(self.exits[split.getIdent()], flows)
+            elif (self.chooser!=None):
+                index=self.chooser.choose(split, flows)
             else:
-                alreadyexplored[newhash]=[copy.deepcopy(currentp)]
+                index=self.sample(self.tables[split.getIdent()], flows)
+            if (flows[index].getIdent() in back):
+                self.iterations[split.getIdent()]=k
+            else:
+                self.iterations[split.getIdent()]=0
+            return index
+        if (self.chooser!=None):
+            return self.chooser.choose(split, flows)
+        return self.sample(self.tables[split.getIdent()], flows)
 
-            # simulates
-            log=currentp.simulateANDanalyse(nbreplicas, False, snumber)
+##
+# Durations of the tasks with random durations (see Duration) for nbsim simulations: the
+# durations of a task form a matrix, one row per simulation, column k containing the duration
+# of the k-th execution of the task in each simulation. Columns are drawn with NumPy by blocks
+# of DURATIONBLOCK columns, when they are needed, from a generator seeded with seed, the task
+# identifier and the number of the block (so that the durations do not depend on the order in
+# which they are needed, nor on the process in which they are drawn).
+class DurationSamples:
+
+    def __init__(self, seed, nbsim):
+        self.seed=seed
+        self.nbsim=nbsim
+        self.matrices={}    # task ident -> matrix of durations
+
+    # returns the duration of the k-th execution of a task in simulation number rep
+    def getSample(self, rep, task, k):
+        matrix=self.matrices.get(task.getIdent())
+        while (matrix is None) or (k>=matrix.shape[1]):
+            block=0 if (matrix is None) else matrix.shape[1]//DURATIONBLOCK
+            key=int(hashlib.sha1(task.getIdent().encode()).hexdigest()[:8], 16)
+            rng=np.random.default_rng([self.seed, key, block])
+            values=task.getDuration().sampleArray(rng, (self.nbsim, DURATIONBLOCK))
+            if (matrix is None):
+                matrix=values
+            else:
+                matrix=np.concatenate((matrix, values), axis=1)
+            self.matrices[task.getIdent()]=matrix
+        return float(matrix[rep, k])
 
-            if (log[1]<tmin):
-                tmin=log[1]
-                bestproc=currentp
-                isbest=True
+##
+# Durations of tasks for one simulation: tasks with a fixed duration take their time, the
+# durations of the other ones are taken from the row rep of a DurationSamples object (one
+# duration per execution of the task), or drawn with the random module if samples is None.
+class DurationSampler:
+
+    def __init__(self, samples, rep):
+        self.samples=samples
+        self.rep=rep
+        self.visits={}      # task ident -> number of executions of the task
+
+    # returns the duration of the next execution of a task
+    def getDuration(self, task):
+        if not(task.isStochastic()):
+            return task.getTime()
+        if (self.samples==None):
+            return task.getDuration().sample(random)
+        k=self.visits.get(task.getIdent(), 0)
+        self.visits[task.getIdent()]=k+1
+        return self.samples.getSample(self.rep, task, k)
 
-            # computes from the log all tasks that can be executed earlier in the process
-            if (strategy=="exploration"):
-                tasks=set()
-                for entry in log[0]:
-                    tasks.add(entry[1])
-            # (strategy=="heuristic")
-            # we keep only tasks that are waiting the less before being executed
-            # if there are several ones with the same time, we keep all of them
+##
+# A process compiled for simulation: nodes, flows and resources are numbered, and the
+# simulation (CompiledProcess.simulate) works on lists indexed by these numbers (successors,
+# kinds of nodes, resources of tasks as lists and bitmasks) instead of the graph.
+# The simulation follows the same steps as simulateEvents (it gives the same results with
+# the same random numbers), and analyses the execution on the fly (see OnlineAnalysis).
+# Tokens are numbers: flow number i is token i, task number j is token nbflows+j.
+class CompiledProcess:
+
+    # kinds of nodes
+    ACTIVITY=0
+    END=1
+    EXCSPLIT=2
+    PARSPLIT=3
+    EXCJOIN=4
+    PARJOIN=5
+    OTHER=6
+
+    def __init__(self, proc):
+        flows=list(proc.getFlows())
+        nodes=list(proc.getNodes())
+        self.nbflows=len(flows)
+        flownum={}
+        for i in range(len(flows)):
+            flownum[flows[i].getIdent()]=i
+        nodenum={}
+        for i in range(len(nodes)):
+            nodenum[nodes[i].getIdent()]=i
+        # resources (in the order of computeResources)
+        self.resources=list(proc.computeResources(1))
+        resnum={}
+        for i in range(len(self.resources)):
+            resnum[self.resources[i]]=i
+        # tasks, in the order of the task status of simulate (analysis results are in this order)
+        self.tasks=[]
+        for key in proc.buildTaskStatus():
+            self.tasks.append(nodenum[key])
+
+        self.flows=flows                                    # flow objects (for choosers)
+        self.target=[nodenum[f.getTarget().getIdent()] for f in flows]
+        self.nodes=nodes                                    # node objects
+        self.idents=[n.getIdent() for n in nodes]
+        self.kind=[]
+        self.time=[]
+        self.duration=[]    # distribution of the duration of tasks with random durations (None otherwise)
+        self.res=[]         # resources of tasks (numbers)
+        self.resset=[]      # resources of tasks (as given by getRes)
+        self.mask=[]        # resources of tasks (bitmask)
+        self.outflows=[]    # numbers of the outgoing flows (in the order of getOutgoingFlows)
+        self.inflows=[]     # numbers of the incoming flows
+        self.branches=[]    # alias tables of the probabilities of the outgoing flows of exclusive splits
+        for n in nodes:
+            if (n.kind is NodeKind.ACTIVITY):
+                self.kind.append(CompiledProcess.ACTIVITY)
+                self.time.append(n.getTime())
+                self.duration.append(n.getDuration() if n.isStochastic() else None)
+                self.res.append([resnum[r] for r in n.getRes()])
+                self.resset.append(n.getRes())
+                mask=0
+                for r in n.getRes():
+                    mask=mask|(1<<resnum[r])
+                self.mask.append(mask)
             else:
-                tasks=self.computeSetTasks(log)
-                tasks2=list(tasks)
-                if (len(tasks2)!=0):
-                    tasks=set()
-                    tasks.add(tasks2[0])
+                if (n.kind is NodeKind.END):
+                    self.kind.append(CompiledProcess.END)
+                elif (n.kind is NodeKind.SPLIT) and (n.getType()=="exclusive"):
+                    self.kind.append(CompiledProcess.EXCSPLIT)
+                elif (n.kind is NodeKind.SPLIT) and (n.getType()=="parallel"):
+                    self.kind.append(CompiledProcess.PARSPLIT)
+                elif (n.kind is NodeKind.JOIN) and (n.getType()=="exclusive"):
+                    self.kind.append(CompiledProcess.EXCJOIN)
+                elif (n.kind is NodeKind.JOIN) and (n.getType()=="parallel"):
+                    self.kind.append(CompiledProcess.PARJOIN)
                 else:
-                    tasks=set()
+                    self.kind.append(CompiledProcess.OTHER)
+                self.time.append(0)
+                self.duration.append(None)
+                self.res.append([])
+                self.resset.append(None)
+                self.mask.append(0)
+            self.outflows.append([flownum[f.getIdent()] for f in proc.getOutgoingFlows(n.getIdent())])
+            if (self.kind[-1]==CompiledProcess.EXCSPLIT):
+                self.branches.append(buildAliasTable(branchProbabilities([flows[f] for f in self.outflows[-1]])))
+            else:
+                self.branches.append(None)
+            self.inflows.append([flownum[f.getIdent()] for f in proc.getIncomingFlows(n.getIdent())])
+        self.start=self.outflows[nodenum[proc.getStartNode().getIdent()]][0]
+
+    # simulation of the process ONCE (nbreplicas is the nb of replicas of resources, see computeResources)
+    # returns the same couple as simulateOnce (execution time, tasks that could have been executed earlier)
+    # the optional chooser parameter chooses the outgoing flows of exclusive splits (see simulate)
+    # the optional sampler parameter (DurationSampler) gives the durations of tasks (see simulateEvents)
+    # if the simulation is blocked, the execution time is infinite (see simulateOnce)
+    def simulate(self, nbreplicas, chooser=None, sampler=None):
+        nbflows=self.nbflows
+        target=self.target
+        kind=self.kind
+        outflows=self.outflows
+        inflows=self.inflows
+        tasktime=self.time
+        taskres=self.res
+        taskmask=self.mask
+        tasks=self.tasks
+        branches=self.branches
 
+        gtime=0
+        queue=[(self.start, 0)]     # tokens (number, completion time)
+        calendar=[]
+        if isinstance(nbreplicas, dict):
+            available=[nbreplicas.get(r, 1) for r in self.resources]
+        else:
+            available=[nbreplicas]*len(self.resources)
+        full=0                      # bitmask of the resources with no replica available
+        for r in range(len(available)):
+            if (available[r]<=0):
+                full=full|(1<<r)
+        WAITING, RUNNING, COMPLETED = 0, 1, 2
+        status=[WAITING]*len(kind)
+
+        # online analysis (see OnlineAnalysis)
+        restasks=[]
+        pending=[]
+        nbentries=0
+        lasttime=0
+
+        # records one entry of the simulation
+        def record(etime):
+            nonlocal pending, nbentries, lasttime
+            if (nbentries>1):
+                for time in timeUnits(lasttime, etime):
+                    for t in pending:
+                        restasks.append((time, t))
+            pending=[]
             for t in tasks:
-                newp=copy.deepcopy(currentp)
-                p=self.refactor3(currentp, newp, t, False)
-                newp=self.simplify(copy.deepcopy(p[0]))
-                if (p[1]):
-                    # we check if the new process respects the strong dependencies defined in the initial process
-                    if (self.preserveDependencies(newp, depend)):
-                        # we check if the process is not in one of the two queues
-                        # TODO: write 'procInProcessesDIC'
-                        newhash=newp.computeHashValue(newp)
-                        if not(self.procInProcessesDIC(newhash, newp, alreadyexplored)) and not(self.procInProcessesDIC(newhash, newp, tobeexploredDIC)):
+                if (status[t]==WAITING) and not(taskmask[t] & full):
+                    pending.append(t)
+            nbentries=nbentries+1
+            lasttime=etime
 
-                            #if isbest:
-                                # we put at the beginning of the queue / list
-                            #    tobeexplored.insert(0,copy.deepcopy(newp))
-                            #else:
-                            tobeexplored.append(copy.deepcopy(newp))
+        while (queue!=[]):
+
+            record(gtime)
+
+            queuezero=[c for c in queue if c[1]<=gtime]
+            queuenottriggered=[]
 
-                            if (newhash in tobeexploredDIC.keys()):
-                                tobeexploredDIC[newhash].append(copy.deepcopy(newp))
+            while (queuezero!=[]):
+                c=queuezero.pop(0)
+                token=c[0]
+                donesomething=False
+
+                # end of a task execution
+                if (token>=nbflows):
+                    t=token-nbflows
+                    queue=[c2 for c2 in queue if c2[0]!=token]
+                    f=outflows[t][0]
+                    queue.append((f, gtime))
+                    queuezero.append((f, gtime))
+                    for r in taskres[t]:
+                        available[r]=available[r]+1
+                        if (available[r]>0):
+                            full=full&~(1<<r)
+                    status[t]=COMPLETED
+                    donesomething=True
+
+                # token on a flow
+                else:
+                    n=target[token]
+                    k=kind[n]
+                    if (k==CompiledProcess.ACTIVITY):
+                        if not(taskmask[n] & full):
+                            for r in taskres[n]:
+                                available[r]=available[r]-1
+                                if (available[r]<=0):
+                                    full=full|(1<<r)
+                            queue=[c2 for c2 in queue if c2[0]!=token]
+                            if (sampler==None):
+                                duration=tasktime[n]
                             else:
-                                tobeexploredDIC[newhash]=[copy.deepcopy(newp)]
+                                duration=sampler.getDuration(self.nodes[n])
+                            queue.append((nbflows+n, gtime+duration))
+                            if (duration==0):
+                                queuezero.append((nbflows+n, gtime))
+                            else:
+                                heapq.heappush(calendar, gtime+duration)
+                            status[n]=RUNNING
+                            donesomething=True
+                    elif (k==CompiledProcess.END):
+                        queue=[c2 for c2 in queue if c2[0]!=token]
+                        donesomething=True
+                    elif (k==CompiledProcess.EXCSPLIT):
+                        queue=[c2 for c2 in queue if c2[0]!=token]
+                        outf=outflows[n]
+                        if (chooser==None):
+                            randflow=sampleBranch(branches[n], len(outf), random)
+                        else:
+                            randflow=chooser.choose(self.nodes[n], [self.flows[f] for f in outf])
+                        queue.append((outf[randflow], gtime))
+                        queuezero.append((outf[randflow], gtime))
+                        donesomething=True
+                    elif (k==CompiledProcess.PARSPLIT):
+                        queue=[c2 for c2 in queue if c2[0]!=token]
+                        for f in outflows[n]:
+                            queue.append((f, gtime))
+                            queuezero.append((f, gtime))
+                        donesomething=True
+                    elif (k==CompiledProcess.EXCJOIN):
+                        queue=[c2 for c2 in queue if c2[0]!=token]
+                        f=outflows[n][0]
+                        queue.append((f, gtime))
+                        queuezero.append((f, gtime))
+                        donesomething=True
+                    elif (k==CompiledProcess.PARJOIN):
+                        due=set()
+                        for c2 in queue:
+                            if (c2[1]<=gtime):
+                                due.add(c2[0])
+                        ready=True
+                        for f in inflows[n]:
+                            if not(f in due):
+                                ready=False
+                        if ready:
+                            inf=set(inflows[n])
+                            queue=[c2 for c2 in queue if not(c2[0] in inf)]
+                            queuezero=[c2 for c2 in queuezero if not(c2[0] in inf)]
+                            f=outflows[n][0]
+                            queue.append((f, gtime))
+                            queuezero.append((f, gtime))
+                            donesomething=True
 
-        if (ind>=bound):
-            print("Warning: exploration was stopped because max bound was reached.")
+                if not(donesomething):
+                    queuenottriggered.append(c)
+                else:
+                    queuezero=queuezero+queuenottriggered
 
-        return (bestproc, inittime, tmin, alreadyexplored)
+            if (queue==[]):
+                break
+
+            # we jump to the next completion time in the calendar
+            while (calendar!=[]) and (calendar[0]<=gtime):
+                heapq.heappop(calendar)
+            if (calendar==[]):
+                # only blocked tokens remain
+                return (float("inf"), [])
+            nexttime=calendar[0]
+            if (nexttime>gtime+1):
+                # entry standing for the time units between gtime+1 and nexttime-1
+                record(gtime+1)
+            gtime=nexttime
+
+        # tasks still waiting at the end are removed (see purge)
+        res=[]
+        for c in restasks:
+            if (status[c[1]]!=WAITING):
+                res.append((c[0], self.idents[c[1]], self.resset[c[1]]))
+        return (lasttime, res)
+
+    # simulation of several cases (instances) of the process, sharing the resources
+    # arrivals is the (sorted) list of arrival times of cases, rng the random generator used for
+    #  the choices of exclusive splits (and for random durations)
+    # tasks waiting for a resource are served in FIFO order: a task starts when it is at the head
+    #  of the queue of one of its resources and all its resources are available
+    # returns a couple (list of couples (arrival time, completion time) of cases,
+    #  dictionary resource number -> time during which one replica of the resource was used)
+    def simulateCases(self, nbreplicas, arrivals, rng):
+        nbflows=self.nbflows
+        target=self.target
+        kind=self.kind
+        outflows=self.outflows
+        inflows=self.inflows
+        taskres=self.res
+
+        if isinstance(nbreplicas, dict):
+            available=[nbreplicas.get(r, 1) for r in self.resources]
+        else:
+            available=[nbreplicas]*len(self.resources)
+        busy=[0]*len(self.resources)
+        # tasks waiting for resources: one queue per resource of entries [order, case, task, waiting]
+        waiting=[collections.deque() for r in self.resources]
+        order=0
+
+        # events (time, order, case, task), task being -1 for the arrival of a case
+        events=[]
+        for c in range(len(arrivals)):
+            heapq.heappush(events, (arrivals[c], order, c, -1))
+            order=order+1
+        active=[0]*len(arrivals)        # nb of tokens of each case
+        joins=[{} for c in arrivals]    # tokens waiting in parallel joins (flow -> nb) of each case
+        cases=[None]*len(arrivals)
+
+        while (events!=[]):
+            gtime, o, case, task = heapq.heappop(events)
+            tokens=[]   # flows with a new token (of case) to be moved forward
+            if (task<0):
+                active[case]=1
+                tokens.append(self.start)
+            else:
+                for r in taskres[task]:
+                    available[r]=available[r]+1
+                tokens.append(outflows[task][0])
+            touched=[]  # resources whose queue may have a task able to start
+            while (tokens!=[]):
+                f=tokens.pop()
+                n=target[f]
+                k=kind[n]
+                if (k==CompiledProcess.ACTIVITY):
+                    entry=[order, case, n, True]
+                    order=order+1
+                    if (len(taskres[n])==0):
+                        self.startTask(entry, gtime, rng, available, busy, events, order)
+                        order=order+1
+                    for r in taskres[n]:
+                        waiting[r].append(entry)
+                        touched.append(r)
+                elif (k==CompiledProcess.END):
+                    active[case]=active[case]-1
+                    if (active[case]==0):
+                        cases[case]=(arrivals[case], gtime)
+                elif (k==CompiledProcess.EXCSPLIT):
+                    tokens.append(outflows[n][sampleBranch(self.branches[n], len(outflows[n]), rng)])
+                elif (k==CompiledProcess.PARSPLIT):
+                    active[case]=active[case]+len(outflows[n])-1
+                    tokens.extend(outflows[n])
+                elif (k==CompiledProcess.EXCJOIN):
+                    tokens.append(outflows[n][0])
+                elif (k==CompiledProcess.PARJOIN):
+                    joined=joins[case]
+                    joined[f]=joined.get(f, 0)+1
+                    ready=True
+                    for f2 in inflows[n]:
+                        if (joined.get(f2, 0)==0):
+                            ready=False
+                    if ready:
+                        for f2 in inflows[n]:
+                            joined[f2]=joined[f2]-1
+                        active[case]=active[case]-len(inflows[n])+1
+                        tokens.append(outflows[n][0])
+                else:
+                    active[case]=active[case]-1
+            # the released resources may be used by waiting tasks: only the head of each queue
+            #  may start, started tasks being removed from the queues (possibly later, for the
+            #  other resources of the task)
+            if (task>=0):
+                touched.extend(taskres[task])
+            while (touched!=[]):
+                queue=waiting[touched.pop()]
+                while (len(queue)>0):
+                    entry=queue[0]
+                    if entry[3]:
+                        free=True
+                        for r in taskres[entry[2]]:
+                            if (available[r]<=0):
+                                free=False
+                        if not(free):
+                            break
+                        self.startTask(entry, gtime, rng, available, busy, events, order)
+                        order=order+1
+                        touched.extend(taskres[entry[2]])
+                    queue.popleft()
+
+        return (cases, busy)
+
+    # start of a waiting task (entry of simulateCases) at time gtime: its resources are taken and
+    #  its completion event is added to the events
+    def startTask(self, entry, gtime, rng, available, busy, events, order):
+        n=entry[2]
+        entry[3]=False
+        if (self.duration[n]==None):
+            duration=self.time[n]
+        else:
+            duration=self.duration[n].sample(rng)
+        for r in self.res[n]:
+            available[r]=available[r]-1
+            busy[r]=busy[r]+duration
+        heapq.heappush(events, (gtime+duration, order, entry[1], n))
+
+##
+# Random numbers used by simulateBatch for the choices of exclusive splits: column k contains
+# the numbers (in [0,1)) used by the k-th choice of each simulation (one row per simulation).
+# Columns are drawn by blocks, when they are needed.
+class BatchChoices:
+
+    def __init__(self, rng, nbsim):
+        self.rng=rng
+        self.matrix=rng.random((nbsim, 8))
+
+    # returns column k
+    def getColumn(self, k):
+        while (k>=self.matrix.shape[1]):
+            self.matrix=np.concatenate((self.matrix, self.rng.random(self.matrix.shape)), axis=1)
+        return self.matrix[:,k]
 
+##
+# Choices of the outgoing flows of exclusive splits for a group of simulations of simulateBatch
+# (rows), which made the same choices (prefix) so far. At each new choice, the group is split
+# according to the choices of its simulations: the simulation goes on with the first part, the
+# other parts (with their choices) are kept in others, to be simulated later.
+class BatchChooser:
+
+    def __init__(self, choices, prefix, rows):
+        self.choices=choices
+        self.prefix=prefix
+        self.rows=rows          # simulations following this execution
+        self.taken=[]           # indexes of the chosen flows
+        self.others=[]          # couples (choices, simulations) of the other parts of the group
+
+    # chooses the outgoing flow of a split, returns its index in flows
+    def choose(self, split, flows):
+        k=len(self.taken)
+        if (k<len(self.prefix)):
+            index=self.prefix[k]
+        else:
+            probs=branchProbabilities(flows)
+            if (max(probs)-min(probs)<1e-12):
+                values=np.floor(self.choices.getColumn(k)[self.rows]*len(flows)).astype(int)
+            else:
+                values=np.minimum(np.searchsorted(np.cumsum(probs), self.choices.getColumn(k)[self.rows], side="right"), len(flows)-1)
+            index=int(values[0])
+            for v in np.unique(values):
+                if (v!=index):
+                    self.others.append((self.taken+[int(v)], self.rows[values==v]))
+            self.rows=self.rows[values==index]
+        self.taken.append(index)
+        return index
+
+##
+# An online analysis of one simulation: it receives the entries (gtime, resources, taskstatus)
+# of the simulation one after the other (record), and computes on the fly the same tuples as
+# the analyse method (tasks which could have been executed earlier) and the execution time,
+# without keeping the log. Only the waiting tasks with available resources of the last entry
+# are kept, until the time of the next entry is known.
+class OnlineAnalysis:
+
+    def __init__(self, proc):
+        self.proc=proc
+        self.restasks=[]    # tuples (time, task, resources) found so far
+        self.nbentries=0    # number of recorded entries
+        self.lasttime=0     # global time of the last recorded entry
+        self.pending=[]     # couples (task, resources) which could be executed in the last entry
+        self.taskstatus={}  # task status of the simulation (the last one at the end)
+
+    # records one entry of the simulation (the dictionaries are read, not kept as they are)
+    def record(self, gtime, resources, taskstatus):
+        # the previous entry stands for all the time units until this one
+        # (the first entry, gtime 0 where all resources are still available, is skipped)
+        if (self.nbentries>1):
+            for time in timeUnits(self.lasttime, gtime):
+                for c in self.pending:
+                    self.restasks.append((time, c[0], c[1]))
+        self.pending=[]
+        for key in taskstatus:
+            if (taskstatus[key]=="waiting"):
+                res=self.proc.getNode(key).getRes()
+                if self.proc.resAvailable(res, resources):
+                    self.pending.append((key, res))
+        self.nbentries=self.nbentries+1
+        self.lasttime=gtime
+        self.taskstatus=taskstatus
+
+    # returns the execution time (global time of the last entry)
+    def getEndTime(self):
+        return self.lasttime
+
+    # returns the tasks that could have been executed earlier (same result as analyse)
+    # the last entry is not taken into account, and tasks still waiting at the end of
+    #  the simulation are removed (see purge)
+    def getResult(self):
+        res=[]
+        for c in self.restasks:
+            if (self.taskstatus[c[1]]!="waiting"):
+                res.append(c)
+        return res
 
 
+##
+# A cache of simulation results (couples (log, average execution time) returned by
+# simulateANDanalyse), indexed by the fingerprint of the process, the number of replicas,
+# the number of simulations, the seed and the engine. Logs are stored with the canonical labels of
+# tasks (see computeNodeLabels) instead of their identifiers, so that a result can be
+# reused for the same process reached through different refactorings.
+# The least recently used entries are evicted when there are more than size entries.
+# If a file name is given, results are also stored on disk (shelve) and reused across runs.
+class SimulationCache:
+
+    def __init__(self, size=10000, filename=None):
+        self.size=size
+        self.entries=collections.OrderedDict()
+        self.store=None
+        if (filename!=None):
+            self.store=shelve.open(filename)
+        self.hits=0
+        self.misses=0
+
+    # computes the entry of a simulation: a tuple (key, ident -> label, label -> ident)
+    # returns None if the result cannot be cached (two tasks with the same label)
+    # (ciwidth and confidence are those of the adaptive mode of simulateANDanalyse)
+    # the tick, event and compiled engines give the same results for the same seed, the batch
+    #  engine draws its random numbers differently, so it has its own entries
+    def prepare(self, proc, nbreplicas, snumber, seed, engine="tick", ciwidth=None, confidence=0.95):
+        # a dictionary of replicas (see computeResources) is given in a canonical form
+        if isinstance(nbreplicas, dict):
+            nbreplicas=tuple(sorted(nbreplicas.items()))
+        labels=proc.computeNodeLabels(proc)
+        identof={}
+        for t in proc.getTasks():
+            identof[labels[t.getIdent()]]=t.getIdent()
+        if (len(identof)!=len(proc.getTasks())):
+            return None
+        ekey="batch" if (engine=="batch") else "sim"
+        if (ciwidth==None):
+            key=repr((proc.computeFingerprint(proc, labels), nbreplicas, snumber, seed, ekey))
+        else:
+            key=repr((proc.computeFingerprint(proc, labels), nbreplicas, snumber, seed, ekey, ciwidth, confidence))
+        return (key, labels, identof)
+
+    # returns the result stored for an entry (with the identifiers of the process), or None
+    def get(self, entry):
+        if (entry==None):
+            return None
+        key=entry[0]
+        if (key in self.entries):
+            self.entries.move_to_end(key)
+            res=self.entries[key]
+        elif (self.store!=None) and (key in self.store):
+            res=self.store[key]
+            self.remember(key, res)
+        else:
+            self.misses=self.misses+1
+            return None
+        self.hits=self.hits+1
+        log=[]
+        for c in res[0]:
+            log.append((c[0], entry[2][c[1]], c[2]))
+        return (log, res[1])
+
+    # stores the result of the simulation corresponding to an entry
+    def put(self, entry, result):
+        if (entry==None):
+            return
+        log=[]
+        for c in result[0]:
+            log.append((c[0], entry[1][c[1]], c[2]))
+        res=(log, result[1])
+        self.remember(entry[0], res)
+        if (self.store!=None):
+            self.store[entry[0]]=res
+
+    # adds a result in memory, evicting the least recently used one if the cache is full
+    def remember(self, key, res):
+        self.entries[key]=res
+        self.entries.move_to_end(key)
+        if (len(self.entries)>self.size):
+            self.entries.popitem(last=False)
+
+    # closes the on-disk store (if any)
+    def close(self):
+        if (self.store!=None):
+            self.store.close()
+            self.store=None
+
+
+# process simulated by the workers of the pool used in simulateANDanalyse
+# (it is sent once to each worker, and not once per simulation)
+workerproc=None
+
+# initialises a worker of the pool used in simulateANDanalyse
+def initReplicaWorker(proc, nbreplicas, verbose, engine, snapshots=False, streams=None, branchorder=None, samples=None, loopflows=None, maxiterations=None):
+    global workerproc
+    workerproc=(proc, nbreplicas, verbose, engine, snapshots, streams, branchorder, samples, loopflows, maxiterations)
+
+# runs one simulation of the process of the worker
+# takes as input a couple (seed, simulation number), the number is used with the streams (if any)
+def simulateReplica(job):
+    proc, nbreplicas, verbose, engine, snapshots, streams, branchorder, samples, loopflows, maxiterations = workerproc
+    chooser=None
+    if (streams!=None):
+        chooser=StreamChooser(streams, job[1], branchorder)
+    if (loopflows!=None):
+        chooser=LoopChooser(proc, loopflows, maxiterations, chooser)
+    sampler=None
+    if (samples!=None):
+        sampler=DurationSampler(samples, job[1])
+    return proc.simulateOnce(nbreplicas, verbose, engine, job[0], snapshots, chooser, sampler)
+
+# number of fresh identifiers reserved for the refactoring of one candidate process
+#  in a parallel exploration (see computeOptimalRefactoringV2)
+COUNTERSTRIDE=100000
+
+# parameters of the exploration shared by the workers of the pool used in computeOptimalRefactoringV2
+workerexploration=None
+
+# initialises a worker of the pool used in computeOptimalRefactoringV2
+def initExplorationWorker(initialp, nbreplicas, snumber, strategy, depend, ciwidth=None, engine="tick", streams=None):
+    global workerexploration
+    workerexploration=(initialp, nbreplicas, snumber, strategy, depend, ciwidth, engine, streams)
+
+# simulates and refactors one candidate process of the exploration
+# takes as input a tuple (process, first fresh identifier, seed, log or None) and returns a tuple
+#  (log, list of new processes, next fresh identifier), see expandCandidate
+def exploreCandidate(job):
+    global counter
+    currentp, counter, seed, log = job
+    random.seed(seed)
+    initialp, nbreplicas, snumber, strategy, depend, ciwidth, engine, streams = workerexploration
+    res=initialp.expandCandidate(currentp, nbreplicas, snumber, strategy, depend, log, ciwidth=ciwidth, engine=engine, streams=streams)
+    return (res[0], res[1], counter)
+
 
 if __name__ == '__main__':
 
@@ -2543,9 +5058,24 @@ if __name__ == '__main__':
     from subprocess import call
 
     oneex=True
+    checkstructure=False
+
+    # TO CHECK THE MATCHING OF SPLITS AND MERGES (see computeStructure) against the walks, on
+    #  all the splits which are not the exit of a loop (loops have no merge), in p55 and p94
+    if checkstructure:
+        for p in [Examples().proc55()[0], Examples().proc94()[0]]:
+            loopsplits=set([l[1].getIdent() for l in p.computeLoops()])
+            for n in p.getSplits():
+                m=p.getMergeNode(n)
+                if (n.getIdent() in loopsplits):
+                    if (m!=None):
+                        print(p.getName(), "Warning: loop split", n.getIdent(), "matched with", m.getIdent())
+                elif (m!=p.getMergeNodeWalk(n)):
+                    print(p.getName(), "Warning: split", n.getIdent(), "matched with", m.getIdent() if (m!=None) else None)
+            print(p.getName(), "matching checked")
 
     # TO TEST ONE SINGLE EXAMPLE
-    if oneex:
+    elif oneex:
         ex=Examples().proc93()
         p=ex[0]
         p.generate_bpmnxml(p.getName()+"_before")
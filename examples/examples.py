@@ -3223,6 +3223,36 @@ class Examples:
         proc = BPMNGraph("p93", {s, t1, t2, t3, t4, t5, t6, t7, e, g1, g2, g3, g4, g5, g6}, {f555, f111, f1, f2, f3, f4, f5, f6, f7, f8, f9, f10, f11, f21, f22, f23, f24})
         return (proc, 25)
 
+    # loop whose back flow goes through a task (the exit split g2 has no merge, see computeStructure)
+    # (not in getAllProcesses, there is no expected time)
+    def proc94(self):
+
+        # nodes
+        s = Start("s")
+        a = Activity("a","A",5,{"r1"})
+        a1 = Activity("a1","A1",10,{"r1"})
+        a2 = Activity("a2","A2",10,{"r2"})
+        a3 = Activity("a3","A3",5,{"r1"})
+        ab = Activity("ab","AB",5,{"r2"})
+        e = End("e")
+        g1 = Join("g1", "exclusive")
+        g2 = Split("g2", "exclusive")
+
+        # flows
+        f1 = Flow("f1", s, a)
+        f2 = Flow("f2", a, g1)
+        f3 = Flow("f3", g1, a1)
+        f4 = Flow("f4", a1, a2)
+        f5 = Flow("f5", a2, g2)
+        f6 = Flow("f6", g2, a3)
+        f7 = Flow("f7", a3, e)
+        f8 = Flow("f8", g2, ab)
+        f9 = Flow("f9", ab, g1)
+
+        # BPMN graph
+        proc = BPMNGraph("p94", {s, a, a1, a2, a3, ab, e, g1, g2}, {f1, f2, f3, f4, f5, f6, f7, f8, f9})
+        return (proc, None)
+
 
 
     def getAllProcesses(self):